@@ -0,0 +1,233 @@
+import time
+
+from psycopg2.errors import DeadlockDetected
+
+from sql_queries import file_savepoint, file_savepoint_release, file_savepoint_rollback
+
+
+# times a file is retried after being chosen as a deadlock victim
+DEADLOCK_RETRIES = 3
+
+
+class CommitPolicy:
+    """
+    Decides when a batch of loaded files is committed. A commit happens as
+    soon as any configured limit is reached; limits left as None are
+    ignored. With no limit at all, every file is committed on its own.
+
+    Parameters
+    ----------
+    files :
+        commit after this many files
+    rows :
+        commit after this many rows
+    seconds :
+        commit once the open transaction is this many seconds old
+
+    Examples
+    --------
+    A rows-only policy keeps batching files until the row limit is reached:
+
+    >>> policy = CommitPolicy(rows=100000)
+    >>> policy.record(10)
+    >>> policy.due()
+    False
+    >>> policy.record(100000)
+    >>> policy.due()
+    True
+    >>> policy = CommitPolicy(seconds=30)
+    >>> policy.record(10)
+    >>> policy.due()
+    False
+    >>> policy = CommitPolicy()
+    >>> policy.record(10)
+    >>> policy.due()
+    True
+    """
+
+    def __init__(self, files=None, rows=None, seconds=None):
+        if files is None and rows is None and seconds is None:
+            files = 1
+        self.files = files
+        self.rows = rows
+        self.seconds = seconds
+        self.reset()
+
+    def reset(self):
+        """Start a new batch."""
+        self.batch_files = 0
+        self.batch_rows = 0
+        self.batch_start = time.monotonic()
+
+    def record(self, rows, files=1):
+        """Count loaded files and their rows against the current batch."""
+        self.batch_files += files
+        self.batch_rows += rows
+
+    def due(self):
+        """Whether the current batch should be committed."""
+        return (
+            (self.files is not None and self.batch_files >= self.files)
+            or (self.rows is not None and self.batch_rows >= self.rows)
+            or (self.seconds is not None
+                and time.monotonic() - self.batch_start >= self.seconds)
+        )
+
+
+class Progress:
+    """
+    Prints files processed and load throughput as files complete.
+
+    Parameters
+    ----------
+    num_files :
+        total number of files to be processed
+    """
+
+    def __init__(self, num_files):
+        self.num_files = num_files
+        self.files = 0
+        self.rows = 0
+        self.start = time.monotonic()
+
+    def update(self, rows, files=1):
+        """Count processed files and print progress."""
+        self.files += files
+        self.rows += rows
+        elapsed = time.monotonic() - self.start
+        print('{}/{} files processed, {} rows ({:.0f} rows/sec).'.format(
+            self.files,
+            self.num_files,
+            self.rows,
+            self.rows / elapsed if elapsed else 0
+        ))
+
+
+def chunk_files(files, size):
+    """
+    Group files into tuples of at most `size` paths, to be loaded with a
+    single call of a function that takes many files at once.
+
+    Parameters
+    ----------
+    files :
+        list of file paths
+    size :
+        maximum number of files per group
+
+    Returns
+    -------
+    list of tuples of file paths
+    """
+    return [tuple(files[i:i + size]) for i in range(0, len(files), size)]
+
+
+def unit_files(unit):
+    """
+    The file paths in a unit of work: a single path, or a tuple of paths
+    from `chunk_files`.
+    """
+    return unit if isinstance(unit, tuple) else (unit,)
+
+
+def _load_unit(cur, conn, datafile, func, policy):
+    """
+    Load one entry of `files` for `load_files` inside its own savepoint.
+
+    A deadlock means another loader waits on row locks held by the files
+    already loaded in this batch, while this file waits on its locks. The
+    file is rolled back, the batch so far committed to release its locks,
+    and the file retried, up to `DEADLOCK_RETRIES` times.
+
+    Returns
+    -------
+    (rows written, None), or (0, error message) if the file failed
+    """
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        cur.execute(file_savepoint)
+        try:
+            rows = func(cur, datafile)
+        except DeadlockDetected as e:
+            cur.execute(file_savepoint_rollback)
+            if attempt == DEADLOCK_RETRIES:
+                return 0, repr(e)
+            conn.commit()
+            policy.reset()
+        except Exception as e:
+            cur.execute(file_savepoint_rollback)
+            return 0, repr(e)
+        else:
+            cur.execute(file_savepoint_release)
+            return rows, None
+
+
+def load_files(cur, conn, files, func, policy=None):
+    """
+    Load files inside batched transactions. Each file runs within its own
+    savepoint, so a file that fails rolls back only its own rows and the
+    rest of the batch is kept. Batches are committed as `policy` dictates,
+    and whatever is left is committed once `files` is exhausted.
+
+    An entry of `files` may also be a tuple of paths (see `chunk_files`),
+    which is passed to `func` whole and succeeds or fails as one.
+
+    With several loaders batching commits, a file may deadlock with
+    another loader on rows of 'users' or 'artists' locked by earlier files
+    of the batch; it is then retried, see `_load_unit`.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+    conn :
+        psycopg2 connection object
+    files :
+        iterable of file paths
+    func :
+        function to parse & load a file, called as func(cur, filepath) and
+        returning the number of rows written
+    policy :
+        `CommitPolicy`, defaults to committing after every file
+
+    Yields
+    ------
+    (filepath, rows written, error message or None) per entry of `files`
+    """
+    policy = policy or CommitPolicy()
+    policy.reset()
+
+    for datafile in files:
+        rows, error = _load_unit(cur, conn, datafile, func, policy)
+        if error is not None:
+            yield datafile, 0, error
+            continue
+
+        policy.record(rows, len(unit_files(datafile)))
+        if policy.due():
+            conn.commit()
+            policy.reset()
+
+        yield datafile, rows, None
+
+    conn.commit()
+
+
+def raise_for_errors(errors):
+    """
+    Report files that failed to load.
+
+    Parameters
+    ----------
+    errors :
+        dict of filepath (or tuple of paths) -> error message
+
+    Raises
+    ------
+    RuntimeError
+        `errors` is not empty.
+    """
+    if errors:
+        for datafile, error in errors.items():
+            print('Failed to load {}: {}'.format(datafile, error))
+        num_failed = sum(len(unit_files(unit)) for unit in errors)
+        raise RuntimeError('{} files failed to load'.format(num_failed))
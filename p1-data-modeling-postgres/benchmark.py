@@ -0,0 +1,283 @@
+import io
+import json
+import time
+import resource
+import argparse
+import contextlib
+import multiprocessing as mp
+from queue import Empty
+
+import create_tables
+import etl
+from sql_queries import (
+    song_select,
+    song_lookup_select,
+    plays_by_hour_select,
+    top_songs_select,
+    songs_by_artist_select
+)
+from loaders import LOAD_MODES, PAGE_SIZE
+from batching import CommitPolicy
+from db import connect
+
+# seconds between checks that a load mode's process is still alive
+POLL_SECONDS = 5
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and of any worker processes it
+    has waited for, in MB (Linux reports ru_maxrss in KB).
+    """
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) / 1024
+
+
+def _run_mode(load_mode, options, results):
+    """
+    Reset sparkifydb and load everything in `load_mode`. Runs in a process
+    of its own, so that peak RSS is measured for this load mode alone.
+    """
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_tables.main()
+            stats = etl.main(load_mode, **options)
+    except Exception as e:
+        results.put({'mode': load_mode, 'error': repr(e)})
+        raise
+
+    results.put({
+        'mode': load_mode,
+        'stages': stats,
+        'peak_rss_mb': peak_rss_mb()
+    })
+
+
+def _wait_for_result(proc, queue, poll_seconds=POLL_SECONDS):
+    """
+    The result `proc` puts on `queue`, or None if the process dies without
+    putting one.
+    """
+    while True:
+        try:
+            return queue.get(timeout=poll_seconds)
+        except Empty:
+            if not proc.is_alive():
+                break
+    # a result put just before the process exited may still be in the pipe
+    try:
+        return queue.get(timeout=poll_seconds)
+    except Empty:
+        return None
+
+
+def run_benchmark(load_modes, options):
+    """
+    Run the full ETL once per load mode against a freshly created sparkifydb.
+
+    Parameters
+    ----------
+    load_modes :
+        load modes to benchmark, from `loaders.LOAD_MODES`
+    options :
+        keyword arguments passed on to `etl.main`
+
+    Returns
+    -------
+    list of result dicts, one per load mode
+    """
+    results = []
+    for load_mode in load_modes:
+        queue = mp.Queue()
+        proc = mp.Process(target=_run_mode, args=(load_mode, options, queue))
+        proc.start()
+        result = _wait_for_result(proc, queue)
+        proc.join()
+        if result is not None and 'error' in result:
+            raise RuntimeError('{} load failed: {}'.format(load_mode, result['error']))
+        if result is None or proc.exitcode != 0:
+            # e.g. killed for running out of memory
+            raise RuntimeError('{} load process exited with code {}'.format(
+                load_mode, proc.exitcode
+            ))
+        results.append(result)
+
+    return results
+
+
+def print_results(results):
+    """
+    Print a table of time, files/sec and rows/sec per load mode and stage.
+    """
+    header = '{:<8} {:<11} {:>10} {:>9} {:>11} {:>11} {:>12}'
+    row = '{:<8} {:<11} {:>10.2f} {:>9} {:>11.1f} {:>11.0f} {:>12}'
+    print(header.format('mode', 'stage', 'seconds', 'files', 'files/sec', 'rows/sec', 'peak RSS MB'))
+
+    for result in results:
+        stages = result['stages']
+        total = {
+            key: sum(stage[key] for stage in stages.values())
+            for key in ('seconds', 'files', 'rows')
+        }
+        for name, stage in list(stages.items()) + [('total', total)]:
+            seconds = stage['seconds'] or float('nan')
+            print(row.format(
+                result['mode'],
+                name,
+                stage['seconds'],
+                stage['files'],
+                stage['files'] / seconds,
+                stage['rows'] / seconds,
+                '{:.0f}'.format(result['peak_rss_mb']) if name == 'total' else ''
+            ))
+
+
+def _time_query(cur, query, params_list, repeat):
+    """
+    Best wall time over `repeat` runs of `query` once per entry of
+    `params_list`, in milliseconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for params in params_list:
+            cur.execute(query, params)
+            cur.fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def benchmark_queries(dsn=None, repeat=5, lookups=100):
+    """
+    Time analytics queries and song lookups against an already loaded
+    sparkifydb, first without and then with the secondary indexes from
+    `sql_queries.create_index_queries`. The indexes are left in place.
+
+    Parameters
+    ----------
+    dsn :
+        connection string for sparkifydb, defaults to `db.get_dsn()`
+    repeat :
+        runs per query; the best time is reported
+    lookups :
+        number of different songs looked up with `song_select`
+
+    Returns
+    -------
+    dict of query name -> {'without_indexes', 'with_indexes'} in milliseconds
+    """
+    conn = connect(dsn)
+    cur = conn.cursor()
+
+    cur.execute("SELECT MIN(start_time) FROM songplays")
+    start, = cur.fetchone()
+    cur.execute(song_lookup_select + " LIMIT %s", (lookups,))
+    keys = [(title, name, duration) for title, name, duration, _, _ in cur.fetchall()]
+    artist_names = [{'artist_name': name} for _, name, _ in keys[:10]]
+    conn.commit()
+
+    queries = {
+        'song_select': (song_select, keys),
+        'plays_by_hour': (plays_by_hour_select, [{'start': start}]),
+        'top_songs': (top_songs_select, [{'start': start}]),
+        'songs_by_artist': (songs_by_artist_select, artist_names),
+    }
+
+    results = {name: {} for name in queries}
+    for label, setup in (
+        ('without_indexes', create_tables.drop_indexes),
+        ('with_indexes', create_tables.create_indexes)
+    ):
+        setup(cur, conn)
+        cur.execute("ANALYZE")
+        conn.commit()
+        for name, (query, params_list) in queries.items():
+            results[name][label] = _time_query(cur, query, params_list, repeat)
+            conn.commit()
+
+    conn.close()
+    return results
+
+
+def print_query_results(results):
+    """
+    Print a table of query times without and with indexes.
+    """
+    print('{:<16} {:>16} {:>13} {:>8}'.format('query', 'no indexes (ms)', 'indexes (ms)', 'speedup'))
+    for name, times in results.items():
+        print('{:<16} {:>16.2f} {:>13.2f} {:>7.1f}x'.format(
+            name,
+            times['without_indexes'],
+            times['with_indexes'],
+            times['without_indexes'] / (times['with_indexes'] or float('nan'))
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Sparkify ETL in each load mode. "
+                    "WARNING: drops and recreates sparkifydb for every mode."
+    )
+    parser.add_argument(
+        '-d', '--data',
+        dest="data_dir",
+        default='bench_data',
+        help="Directory holding song_data and log_data, e.g. from generate_data.py"
+    )
+    parser.add_argument(
+        '-m', '--modes',
+        nargs='+',
+        choices=LOAD_MODES,
+        dest="load_modes",
+        default=list(LOAD_MODES),
+        help="Load modes to benchmark (default: all)"
+    )
+    parser.add_argument('-w', '--workers', type=int, dest="workers", default=1)
+    parser.add_argument('--song-batch', type=int, dest="song_batch_size", default=1)
+    parser.add_argument('--log-batch', type=int, dest="log_batch_size", default=1)
+    parser.add_argument('--commit-files', type=int, dest="commit_files", default=None)
+    parser.add_argument('--commit-rows', type=int, dest="commit_rows", default=None)
+    parser.add_argument('--commit-seconds', type=float, dest="commit_seconds", default=None)
+    parser.add_argument('--page-size', type=int, dest="page_size", default=PAGE_SIZE)
+    parser.add_argument('--defer-indexes', action='store_true', dest="defer_indexes", default=False)
+    parser.add_argument(
+        '-q', '--queries',
+        action='store_true',
+        dest="queries",
+        default=False,
+        help="Instead of loading, time analytics queries on the current "
+             "sparkifydb without and with secondary indexes"
+    )
+    parser.add_argument(
+        '-o', '--output',
+        dest="output",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    if args.queries:
+        results = benchmark_queries()
+        print_query_results(results)
+    else:
+        options = dict(
+            workers=args.workers,
+            policy=CommitPolicy(
+                files=args.commit_files,
+                rows=args.commit_rows,
+                seconds=args.commit_seconds
+            ),
+            song_batch_size=args.song_batch_size,
+            log_batch_size=args.log_batch_size,
+            data_dir=args.data_dir,
+            defer_indexes=args.defer_indexes,
+            page_size=args.page_size
+        )
+        results = run_benchmark(args.load_modes, options)
+        print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
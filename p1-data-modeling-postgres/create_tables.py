@@ -1,32 +1,105 @@
-import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+import argparse
 
+from psycopg2 import sql
+from psycopg2.extensions import parse_dsn
 
-def create_database():
+import pandas as pd
+
+from db import connect, get_dsn
+from partitions import SongplayPartitions
+from sql_queries import (
+    create_table_queries, 
+    drop_table_queries, 
+    create_index_queries, 
+    drop_index_queries,
+    index_rename,
+    songplay_relkind_select,
+    songplay_legacy_rename,
+    songplay_legacy_indexes_select,
+    songplay_legacy_months_select,
+    songplay_legacy_copy,
+    songplay_legacy_drop,
+    songplay_id_sequence_reset,
+    songplay_table_create
+)
+
+
+def create_database(reset=True):
     """
     - Creates and connects to the sparkifydb
     - Returns the connection and cursor to sparkifydb
+
+    With `reset`, any existing sparkifydb is dropped first. Otherwise an 
+    existing sparkifydb is kept as it is. Connection settings come from 
+    `db.get_dsn`, including the database name, so the database created is 
+    the one `db.connect` connects to. 
     """
+    dbname = parse_dsn(get_dsn())['dbname']
     
     # connect to default database
-    conn = psycopg2.connect("host=127.0.0.1 dbname=studentdb user=student password=student")
+    conn = connect(get_dsn(admin=True))
     conn.set_session(autocommit=True)
     cur = conn.cursor()
     
-    # create sparkify database with UTF8 encoding
-    cur.execute("DROP DATABASE IF EXISTS sparkifydb")
-    cur.execute("CREATE DATABASE sparkifydb WITH ENCODING 'utf8' TEMPLATE template0")
+    if reset:
+        cur.execute(
+            sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(dbname))
+        )
+
+    cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+    if cur.fetchone() is None:
+        # create sparkify database with UTF8 encoding
+        cur.execute(
+            sql.SQL("CREATE DATABASE {} WITH ENCODING 'utf8' TEMPLATE template0")
+            .format(sql.Identifier(dbname))
+        )
 
     # close connection to default database
     conn.close()    
     
     # connect to sparkify database
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    conn = connect()
     cur = conn.cursor()
     
     return cur, conn
 
 
+def migrate_songplays(cur, conn):
+    """
+    Convert a 'songplays' table from before it was partitioned by month 
+    into the partitioned table, keeping its rows and their songplay_ids. 
+    The old table is renamed, the partitioned one created with a partition 
+    for every month the old one holds, the rows copied across with 
+    INSERT ... SELECT and the old table dropped, all in one transaction. 
+    Does nothing if 'songplays' is missing or already partitioned. 
+
+    Returns
+    -------
+    True if 'songplays' was migrated
+    """
+    cur.execute(songplay_relkind_select)
+    row = cur.fetchone()
+    if row is None or row[0] != 'r':
+        return False
+
+    cur.execute(songplay_legacy_rename)
+    cur.execute(songplay_legacy_indexes_select)
+    for (index,) in cur.fetchall():
+        cur.execute(index_rename.format(index=index))
+
+    cur.execute(songplay_table_create)
+    partitions = SongplayPartitions()
+    cur.execute(songplay_legacy_months_select)
+    for (month,) in cur.fetchall():
+        partitions.ensure(cur, pd.Period(month, freq="M"))
+
+    cur.execute(songplay_legacy_copy)
+    cur.execute(songplay_id_sequence_reset)
+    cur.execute(songplay_legacy_drop)
+    conn.commit()
+    return True
+
+
 def drop_tables(cur, conn):
     """
     Drops each table using the queries in `drop_table_queries` list.
@@ -45,7 +118,27 @@ def create_tables(cur, conn):
         conn.commit()
 
 
-def main():
+def create_indexes(cur, conn):
+    """
+    Creates each missing secondary index using the queries in 
+    `create_index_queries` list. 
+    """
+    for query in create_index_queries:
+        cur.execute(query)
+        conn.commit()
+
+
+def drop_indexes(cur, conn):
+    """
+    Drops each secondary index using the queries in `drop_index_queries` 
+    list, e.g. ahead of a bulk load. 
+    """
+    for query in drop_index_queries:
+        cur.execute(query)
+        conn.commit()
+
+
+def main(keep_existing=False):
     """
     - Drops (if exists) and Creates the sparkify database. 
     
@@ -55,16 +148,42 @@ def main():
     - Drops all the tables.  
     
     - Creates all tables needed. 
+
+    - Creates secondary indexes. 
     
     - Finally, closes the connection. 
+
+    With `keep_existing`, the database, tables and indexes are only created 
+    where they are missing and no data is dropped. This also migrates an 
+    existing database to the current schema, e.g. ahead of an incremental 
+    `etl.py` run: an unpartitioned 'songplays' is converted by 
+    `migrate_songplays`, and columns added since are added to it. 
     """
-    cur, conn = create_database()
+    cur, conn = create_database(reset=not keep_existing)
     
-    drop_tables(cur, conn)
+    if keep_existing:
+        if migrate_songplays(cur, conn):
+            print('Migrated songplays to a table partitioned by month')
+    else:
+        drop_tables(cur, conn)
     create_tables(cur, conn)
+    create_indexes(cur, conn)
 
     conn.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Create the sparkifydb database and tables"
+    )
+    parser.add_argument(
+        '-k', '--keep-existing',
+        action='store_true',
+        dest="keep_existing",
+        default=False,
+        help="Keep an existing database and its data, only creating missing "
+             "tables and indexes"
+    )
+    args = parser.parse_args()
+
+    main(args.keep_existing)
\ No newline at end of file
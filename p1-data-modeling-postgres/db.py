@@ -0,0 +1,214 @@
+import os
+import time
+import configparser
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sparkify.cfg')
+
+# used for any setting missing from the environment and the config file
+DEFAULTS = {
+    'HOST': '127.0.0.1',
+    'PORT': '5432',
+    'DB_NAME': 'sparkifydb',
+    'ADMIN_DB_NAME': 'studentdb',
+    'DB_USER': 'student',
+    'DB_PASSWORD': 'student'
+}
+
+# pooled connections idle for longer than this are checked before reuse
+HEALTH_CHECK_SECONDS = 30
+
+
+def get_dsn(admin=False, config_path=CONFIG_PATH):
+    """
+    Connection string for sparkifydb, or with `admin` for the database used
+    to create and drop sparkifydb.
+
+    Taken from the SPARKIFY_DSN (or SPARKIFY_ADMIN_DSN) environment variable
+    if set. Otherwise built from the [POSTGRES] section of `config_path`
+    (see sparkify.cfg.example), with `DEFAULTS` for missing settings.
+
+    Parameters
+    ----------
+    admin :
+        connect to the admin database instead of sparkifydb
+    config_path :
+        path to an optional config file
+
+    Returns
+    -------
+    libpq connection string
+    """
+    env_dsn = os.environ.get('SPARKIFY_ADMIN_DSN' if admin else 'SPARKIFY_DSN')
+    if env_dsn:
+        return env_dsn
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    settings = dict(DEFAULTS)
+    if config.has_section('POSTGRES'):
+        settings.update({key.upper(): value for key, value in config['POSTGRES'].items()})
+
+    return psycopg2.extensions.make_dsn(
+        host=settings['HOST'],
+        port=settings['PORT'],
+        dbname=settings['ADMIN_DB_NAME' if admin else 'DB_NAME'],
+        user=settings['DB_USER'],
+        password=settings['DB_PASSWORD']
+    )
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that keeps track of the statements it has
+    PREPAREd on the server. Prepared statements live as long as the
+    session, so a statement prepared while loading one file is reused by
+    every later file loaded on the same connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = {}
+        self.last_used = time.monotonic()
+
+    def prepare(self, cur, name, query):
+        """
+        PREPARE `query` as `name` unless it has been prepared already.
+
+        Parameters
+        ----------
+        cur :
+            psycopg2 cursor object on this connection
+        name :
+            statement name
+        query :
+            SQL with `%s` placeholders, as in `sql_queries`
+
+        Returns
+        -------
+        EXECUTE statement for the prepared query, taking the same `%s`
+        parameters as `query`
+
+        Raises
+        ------
+        ValueError
+            `name` was already prepared for a different query.
+        """
+        if name in self.prepared:
+            if self.prepared[name][0] != query:
+                raise ValueError('Statement {} already prepared for another query'.format(name))
+            return self.prepared[name][1]
+
+        num_params = query.count('%s')
+        cur.execute('PREPARE {} AS {}'.format(
+            name,
+            query % tuple('${}'.format(i + 1) for i in range(num_params))
+        ))
+
+        execute = 'EXECUTE {} ({})'.format(name, ', '.join(['%s'] * num_params))
+        if not num_params:
+            execute = 'EXECUTE {}'.format(name)
+        self.prepared[name] = (query, execute)
+        return execute
+
+    def is_healthy(self):
+        """
+        Whether the connection is open and answers a trivial query.
+        """
+        if self.closed:
+            return False
+        try:
+            with self.cursor() as cur:
+                cur.execute('SELECT 1')
+            self.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+
+def connect(dsn=None):
+    """
+    Open a `PreparingConnection`.
+
+    Parameters
+    ----------
+    dsn :
+        libpq connection string, defaults to `get_dsn()`
+
+    Returns
+    -------
+    `PreparingConnection`
+    """
+    return psycopg2.connect(dsn or get_dsn(), connection_factory=PreparingConnection)
+
+
+class ConnectionPool:
+    """
+    Pool of `PreparingConnection`s shared by the stages of a run, so that
+    each stage reuses an open connection and its prepared statements
+    instead of connecting again. Connections idle for longer than
+    `HEALTH_CHECK_SECONDS` are checked before being handed out, and
+    replaced if they no longer work.
+
+    Connections cannot be shared between processes; worker processes open
+    their own with `connect`.
+
+    Parameters
+    ----------
+    dsn :
+        libpq connection string, defaults to `get_dsn()`
+    maxconn :
+        maximum number of connections open at once
+    """
+
+    def __init__(self, dsn=None, maxconn=4):
+        self.dsn = dsn or get_dsn()
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            1, maxconn, self.dsn, connection_factory=PreparingConnection
+        )
+
+    def getconn(self):
+        """
+        Take a working connection from the pool.
+
+        Returns
+        -------
+        `PreparingConnection`
+        """
+        conn = self._pool.getconn()
+        if (time.monotonic() - conn.last_used > HEALTH_CHECK_SECONDS
+                and not conn.is_healthy()):
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    def putconn(self, conn):
+        """
+        Return a connection to the pool. An open transaction is rolled back.
+        """
+        conn.last_used = time.monotonic()
+        self._pool.putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager lending a connection from the pool. Commit before
+        leaving the block; anything uncommitted is rolled back.
+
+        Yields
+        ------
+        `PreparingConnection`
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """Close every connection in the pool."""
+        self._pool.closeall()
@@ -0,0 +1,113 @@
+import pandas as pd
+
+
+class TimeDimension:
+    """
+    Builds rows for the 'time' table, remembering every timestamp already
+    emitted during the run so that repeated timestamps are never sent to
+    the database twice.
+
+    Wrap each unit of work that may be rolled back in `begin` and, if it
+    is, `rollback`: timestamps emitted since `begin` are then forgotten, so
+    a later unit emits them again.
+    """
+
+    def __init__(self):
+        self._seen = set()
+        # keys marked as emitted since `begin`
+        self._unit = []
+
+    def begin(self):
+        """Start a unit of work whose rows may be rolled back."""
+        self._unit = []
+
+    def rollback(self):
+        """Forget the timestamps emitted since `begin`, after their rows were rolled back."""
+        self._seen.difference_update(self._unit)
+        self._unit = []
+
+    def __len__(self):
+        return len(self._seen)
+
+    def build(self, start_time):
+        """
+        Build 'time' rows for the timestamps in `start_time` that have not
+        been emitted yet, and mark them as emitted.
+
+        Parameters
+        ----------
+        start_time :
+            pandas Series of datetime64 timestamps
+
+        Returns
+        -------
+        pandas DataFrame with the columns of the 'time' table, one row per
+        new timestamp, ordered by start_time
+        """
+        t = pd.Series(start_time.unique()).sort_values(ignore_index=True)
+
+        keys = t.astype("int64").tolist()
+        is_new = [key not in self._seen for key in keys]
+        self._seen.update(keys)
+        self._unit.extend(key for key, new in zip(keys, is_new) if new)
+
+        t = t[is_new].reset_index(drop=True)
+        return pd.DataFrame({
+            "start_time": t,
+            "hour": t.dt.hour,
+            "day": t.dt.day,
+            "week": t.dt.isocalendar().week.astype("int64"),
+            "month": t.dt.month,
+            "year": t.dt.year,
+            "weekday": t.dt.weekday
+        })
+
+
+class UserDimension:
+    """
+    Reduces the users seen in a batch of log events to the latest record per
+    user_id, ordered by event timestamp, so that each user is upserted once
+    per batch and `level` ends up as of the user's most recent event.
+    Events with equal timestamps keep the order they were added in.
+    """
+
+    COLS = ["user_id", "first_name", "last_name", "gender", "level"]
+
+    def __init__(self):
+        self._latest = pd.DataFrame(columns=self.COLS + ["ts"])
+
+    def __len__(self):
+        return len(self._latest)
+
+    def add(self, df):
+        """
+        Fold more user records into the reduction.
+
+        Parameters
+        ----------
+        df :
+            pandas DataFrame with columns `COLS` plus 'ts', the event time
+
+        Returns
+        -------
+        None
+        """
+        frames = [df[self.COLS + ["ts"]]]
+        if len(self._latest):
+            frames.insert(0, self._latest)
+
+        self._latest = (
+            pd.concat(frames, ignore_index=True)
+            .sort_values("ts", kind="stable")
+            .drop_duplicates("user_id", keep="last")
+        )
+
+    def rows(self):
+        """
+        The latest record of every user added so far.
+
+        Returns
+        -------
+        pandas DataFrame with columns `COLS`, ordered by user_id
+        """
+        return self._latest.sort_values("user_id")[self.COLS]
@@ -1,11 +1,41 @@
 import os
 import glob
-import psycopg2
+import json
+import time
+import argparse
+from functools import partial
+from itertools import islice
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 import pandas as pd
 from sql_queries import *
+from db import ConnectionPool
+from loaders import LOAD_MODES, PAGE_SIZE, copy_frame, insert_frame
+from song_index import SongIndex
+from dimensions import TimeDimension, UserDimension
+from partitions import SongplayPartitions
+from metrics import Metrics, print_summary, read_records, summarize
+from parallel import load_files_parallel
+from batching import (
+    CommitPolicy, 
+    Progress, 
+    chunk_files, 
+    load_files, 
+    raise_for_errors, 
+    unit_files
+)
+from manifest import pending_files, load_and_record
+
+# log events held in memory at once while loading a log file
+LOG_CHUNK_SIZE = 10000
 
 
-def process_song_file(cur, filepath):
+def process_song_file(cur, filepath, song_index=None):
     """
     Process a single song file, parsing and 
     inserting data into tables 'songs' and 'artists'. 
@@ -16,10 +46,12 @@ def process_song_file(cur, filepath):
         psycopg2 cursor object
     filepath :
         absolute or relative path to song file 
+    song_index :
+        optional `SongIndex` to add the song to
 
     Returns
     -------
-    None
+    number of rows written
     """
     series = pd.read_json(filepath, typ='series')
     
@@ -44,11 +76,155 @@ def process_song_file(cur, filepath):
     artist_data = series[artist_cols].tolist()
     cur.execute(artist_table_insert, artist_data)
 
+    if song_index is not None:
+        song_index.add(
+            series["title"],
+            series["artist_name"],
+            series["duration"],
+            series["song_id"],
+            series["artist_id"]
+        )
+
+    return 2
+
+
+def process_song_files(cur, filepaths, load_mode='insert', song_index=None, 
+                       page_size=PAGE_SIZE):
+    """
+    Process many song files at once: parse them all into one DataFrame, 
+    drop duplicate songs and artists in memory, then load 'songs' and 
+    'artists' once each. As with row-by-row inserts, the first file to 
+    mention a song or artist wins. 
+    
+    Parameters
+    ----------
+    cur : 
+        psycopg2 cursor object
+    filepaths :
+        iterable of absolute or relative paths to song files
+    load_mode :
+        one of `loaders.LOAD_MODES`: 'insert', 'values' or 'prepared' to 
+        write rows with INSERT statements (see `loaders.insert_frame`), or 
+        'copy' to bulk load each table through a staging table (see 
+        `loaders.copy_frame`)
+    song_index :
+        optional `SongIndex` to add the songs to
+    page_size :
+        rows per statement or round trip in 'values' and 'prepared' modes
+
+    Returns
+    -------
+    number of rows written
+    """
+    records = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            records.append(json_loads(f.read()))
+    df = pd.DataFrame.from_records(records)
+
+    song_cols = [
+        "song_id",
+        "title",
+        "artist_id",
+        "year",
+        "duration"
+    ]
+    song_df = df[song_cols].drop_duplicates("song_id").sort_values("song_id")
+
+    artist_cols = {
+        "artist_id": "artist_id",
+        "artist_name": "name",
+        "artist_location": "location",
+        "artist_latitude": "latitude",
+        "artist_longitude": "longitude"
+    }
+    artist_df = (
+        df[list(artist_cols)]
+        .rename(columns=artist_cols)
+        .drop_duplicates("artist_id")
+        .sort_values("artist_id")
+    )
+
+    if load_mode == 'copy':
+        copy_frame(cur, song_df, 'songs')
+        copy_frame(cur, artist_df, 'artists')
+    else:
+        insert_frame(cur, song_df, song_table_insert, load_mode, page_size)
+        insert_frame(cur, artist_df, artist_table_insert, load_mode, page_size)
+
+    if song_index is not None:
+        for row in df.itertuples(index=False):
+            song_index.add(
+                row.title, 
+                row.artist_name, 
+                row.duration, 
+                row.song_id, 
+                row.artist_id
+            )
+
+    return len(song_df) + len(artist_df)
+
+
+def read_log_chunks(filepath, chunksize=LOG_CHUNK_SIZE, metrics=None):
+    """
+    Stream the NextSong events of a log file as DataFrames of at most 
+    `chunksize` rows, so memory use does not grow with the file. Lines are 
+    read `chunksize` at a time and other events are dropped before they are 
+    parsed where possible. 
+
+    Parameters
+    ----------
+    filepath :
+        absolute or relative path to log file 
+    chunksize :
+        maximum number of events per DataFrame
+    metrics :
+        optional `metrics.Metrics` timing the 'filter' and 'parse' stages
+
+    Yields
+    ------
+    pandas DataFrame of NextSong events
+    """
+    metrics = metrics or Metrics()
+    events = []
+    with open(filepath, 'rb') as f:
+        while True:
+            lines = list(islice(f, chunksize))
+            if not lines:
+                break
+
+            with metrics.stage('filter') as stage:
+                stage.bytes = sum(map(len, lines))
+                # cheap substring test skips most other events without parsing
+                lines = [line for line in lines if b'NextSong' in line]
+                stage.rows = len(lines)
+
+            with metrics.stage('parse') as stage:
+                stage.bytes = sum(map(len, lines))
+                parsed = [json_loads(line) for line in lines]
+                events.extend(e for e in parsed if e.get("page") == "NextSong")
+                stage.rows = len(parsed)
+
+                chunks = []
+                while len(events) >= chunksize:
+                    chunks.append(pd.DataFrame.from_records(events[:chunksize]))
+                    events = events[chunksize:]
+
+            yield from chunks
+
+    if events:
+        with metrics.stage('parse'):
+            df = pd.DataFrame.from_records(events)
+        yield df
 
-def process_log_file(cur, filepath):
+
+def process_log_file(cur, filepath, load_mode='insert', song_index=None, 
+                     chunksize=LOG_CHUNK_SIZE, time_dim=None, partitions=None, 
+                     page_size=PAGE_SIZE, metrics=None):
     """
     Process a single log file, extracting user plays of individual
     songs and inserting data into 'time', 'users', and 'songplays' tables.
+    The file is read and loaded in chunks of at most `chunksize` events. 
     
     Parameters
     ----------
@@ -56,130 +232,662 @@ def process_log_file(cur, filepath):
         psycopg2 cursor object
     filepath :
         absolute or relative path to log file 
+    load_mode :
+        one of `loaders.LOAD_MODES`: 'insert', 'values' or 'prepared' to 
+        write rows with INSERT statements (see `loaders.insert_frame`), or 
+        'copy' to bulk load each table through a staging table (see 
+        `loaders.copy_frame`)
+    song_index :
+        `SongIndex` used to resolve song and artist ids. If not given, one 
+        is loaded from the database for this file alone. 
+    chunksize :
+        maximum number of events held in memory at once
+    time_dim :
+        `TimeDimension` remembering the timestamps already loaded, shared 
+        across files to skip repeated timestamps. If not given, one is 
+        created for this file alone. 
+    partitions :
+        `partitions.SongplayPartitions` remembering the monthly partitions 
+        of 'songplays' already created, shared across files. If not given, 
+        one is created for this file alone. 
+    page_size :
+        rows per statement or round trip in 'values' and 'prepared' modes
+    metrics :
+        optional `metrics.Metrics` recording time, rows and bytes per stage 
+        of each file
 
     Returns
     -------
-    None
+    number of rows written
     """
-    df = pd.read_json(filepath, lines=True)
+    return process_log_files(
+        cur, (filepath,), load_mode, song_index, chunksize, time_dim, partitions, 
+        page_size, metrics
+    )
 
-    df = df = df[df["page"]=="NextSong"]
 
-    df["start_time"] = pd.to_datetime(df["ts"], unit="ms")
-    t = df["start_time"]
+def process_log_files(cur, filepaths, load_mode='insert', song_index=None, 
+                      chunksize=LOG_CHUNK_SIZE, time_dim=None, partitions=None, 
+                      page_size=PAGE_SIZE, metrics=None):
+    """
+    Process a batch of log files like `process_log_file`, but upsert 
+    'users' once for the whole batch: each user's latest record by event 
+    time is kept (see `dimensions.UserDimension`), so `level` is that of 
+    the user's most recent play in the batch. 
     
-    time_data = (
-        t,
-        t.dt.hour,
-        t.dt.day,
-        t.dt.week,
-        t.dt.month,
-        t.dt.year,
-        t.dt.weekday
-    )
-    time_cols = (
-        "start_time",
-        "hour",
-        "day",
-        "week",
-        "month",
-        "year",
-        "weekday"
-    )
-    time_df = pd.concat(time_data, axis=1, keys=time_cols)
+    Parameters
+    ----------
+    cur : 
+        psycopg2 cursor object
+    filepaths :
+        iterable of absolute or relative paths to log files
+    load_mode :
+        one of `loaders.LOAD_MODES`: 'insert', 'values' or 'prepared' to 
+        write rows with INSERT statements (see `loaders.insert_frame`), or 
+        'copy' to bulk load each table through a staging table (see 
+        `loaders.copy_frame`)
+    song_index :
+        `SongIndex` used to resolve song and artist ids. If not given, one 
+        is loaded from the database for this batch alone. 
+    chunksize :
+        maximum number of events held in memory at once
+    time_dim :
+        `TimeDimension` remembering the timestamps already loaded, shared 
+        across batches to skip repeated timestamps. If not given, one is 
+        created for this batch alone. 
+    partitions :
+        `partitions.SongplayPartitions` remembering the monthly partitions 
+        of 'songplays' already created, shared across batches. If not 
+        given, one is created for this batch alone. 
+    page_size :
+        rows per statement or round trip in 'values' and 'prepared' modes
+    metrics :
+        optional `metrics.Metrics` recording time, rows and bytes per stage 
+        of each file, committed only once the whole batch has loaded
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+    Returns
+    -------
+    number of rows written
+    """
+    if song_index is None:
+        song_index = SongIndex.from_db(cur)
+    if time_dim is None:
+        time_dim = TimeDimension()
+    if partitions is None:
+        partitions = SongplayPartitions()
+    if metrics is None:
+        metrics = Metrics()
+    user_dim = UserDimension()
 
-    user_cols = [
-        "userId",
-        "firstName",
-        "lastName",
-        "gender",
-        "level"
-    ]
-    user_df = df[user_cols]
+    rows = 0
+    time_dim.begin()
+    partitions.begin()
+    try:
+        for filepath in filepaths:
+            for df in read_log_chunks(filepath, chunksize, metrics):
+                chunk_rows, _ = process_log_frame(
+                    cur, df, load_mode, song_index, time_dim, user_dim, 
+                    partitions, page_size, metrics, source_file=filepath
+                )
+                rows += chunk_rows
+            metrics.flush(filepath)
 
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+        with metrics.stage('user build'):
+            user_df = user_dim.rows()
 
-    for index, row in df.iterrows():
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
+        with metrics.stage('user insert') as stage:
+            if load_mode == 'copy':
+                copy_frame(cur, user_df, 'users')
+            else:
+                insert_frame(cur, user_df, user_table_insert, load_mode, page_size)
+            stage.rows = len(user_df)
+        metrics.flush(tuple(filepaths))
+        rows += len(user_df)
+    except Exception:
+        metrics.discard()
+        # this batch's rows, and any partitions it created, are about to be 
+        # rolled back, including those of the chunk that failed
+        time_dim.rollback()
+        partitions.rollback()
+        raise
 
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
-
-        songplay_data = (
-            row.start_time,
-            row.userId,
-            row.level,
-            songid,
-            artistid,
-            row.sessionId,
-            row.location,
-            row.userAgent
-        )
-        cur.execute(songplay_table_insert, songplay_data)
+    # only now that every file of the batch has loaded are its stages kept
+    metrics.commit()
+    return rows
 
 
-def process_data(cur, conn, filepath, func):
+def process_log_frame(cur, df, load_mode, song_index, time_dim, user_dim, 
+                      partitions, page_size=PAGE_SIZE, metrics=None, 
+                      source_file=None):
     """
-    Retrieve paths to all files in specified dir, then iterate over all files,
-    passing filepaths to the supplied function
+    Load a DataFrame of NextSong events into 'time' and 'songplays' tables, 
+    and add its users to `user_dim` for a later upsert into 'users'. 
+    Song plays are written straight into the partition for their month, 
+    which is created first if needed. 
     
     Parameters
     ----------
     cur : 
         psycopg2 cursor object
-    conn : 
-        psycopg2 connection object
+    df :
+        pandas DataFrame of NextSong events, as from `read_log_chunks`
+    load_mode :
+        one of `loaders.LOAD_MODES`: 'insert', 'values' or 'prepared' to 
+        write rows with INSERT statements (see `loaders.insert_frame`), or 
+        'copy' to bulk load each table through a staging table (see 
+        `loaders.copy_frame`)
+    song_index :
+        `SongIndex` used to resolve song and artist ids
+    time_dim :
+        `TimeDimension` building 'time' rows for new timestamps only
+    user_dim :
+        `UserDimension` collecting the latest record per user
+    partitions :
+        `partitions.SongplayPartitions` creating monthly partitions of 
+        'songplays' as needed
+    page_size :
+        rows per statement or round trip in 'values' and 'prepared' modes
+    metrics :
+        optional `metrics.Metrics` timing the 'time build', 'user build', 
+        'song lookup', 'time insert' and 'songplay insert' stages
+    source_file :
+        path of the log file the events come from, recorded on each song 
+        play so the file's plays can be replaced if it is loaded again
+
+    Returns
+    -------
+    (number of rows written, DataFrame of 'time' rows written)
+    """
+    metrics = metrics or Metrics()
+
+    # user ids are logged as strings
+    df["userId"] = pd.to_numeric(df["userId"]).astype("Int64")
+
+    with metrics.stage('time build') as stage:
+        df["start_time"] = pd.to_datetime(df["ts"], unit="ms")
+        time_df = time_dim.build(df["start_time"])
+        stage.rows = len(time_df)
+
+    user_cols = {
+        "userId": "user_id",
+        "firstName": "first_name",
+        "lastName": "last_name",
+        "gender": "gender",
+        "level": "level",
+        "ts": "ts"
+    }
+    with metrics.stage('user build') as stage:
+        user_dim.add(df[list(user_cols)].rename(columns=user_cols))
+        stage.rows = len(df)
+
+    with metrics.stage('song lookup') as stage:
+        df[["song_id", "artist_id"]] = song_index.resolve(df)
+        stage.rows = len(df)
+
+    songplay_cols = {
+        "start_time": "start_time",
+        "userId": "user_id",
+        "level": "level",
+        "song_id": "song_id",
+        "artist_id": "artist_id",
+        "sessionId": "session_id",
+        "location": "location",
+        "userAgent": "user_agent"
+    }
+    songplay_df = df[list(songplay_cols)].rename(columns=songplay_cols)
+    songplay_df["source_file"] = source_file
+
+    with metrics.stage('time insert') as stage:
+        if load_mode == 'copy':
+            copy_frame(cur, time_df, 'time')
+        else:
+            insert_frame(cur, time_df, time_table_insert, load_mode, page_size)
+        stage.rows = len(time_df)
+
+    with metrics.stage('songplay insert') as stage:
+        # skip routing each row through the parent table
+        for partition, _, month_df in partitions.split(cur, songplay_df):
+            if load_mode == 'copy':
+                copy_frame(cur, month_df, 'songplays', target=partition)
+            else:
+                insert_frame(
+                    cur, 
+                    month_df, 
+                    songplay_partition_insert.format(partition=partition), 
+                    load_mode, 
+                    page_size
+                )
+        stage.rows = len(songplay_df)
+
+    return len(time_df) + len(songplay_df), time_df
+
+
+def get_files(filepath):
+    """
+    Retrieve absolute paths to all JSON files in the specified dir and its 
+    subdirectories, sorted. 
+
+    Parameters
+    ----------
     filepath :
-        absolute or relative path to song or log file
-    func : 
-        function to parse & load file
+        absolute or relative path to song or log data dir
 
     Returns
     -------
-    None
+    list of file paths
     """
-    # get all files matching extension from directory
     all_files = []
     for root, dirs, files in os.walk(filepath):
         files = glob.glob(os.path.join(root,'*.json'))
         for f in files :
             all_files.append(os.path.abspath(f))
 
-    # get total number of files found
-    num_files = len(all_files)
-    print('{} files found in {}'.format(num_files, filepath))
+    # a stable order keeps runs repeatable, e.g. which batch a file lands in
+    return sorted(all_files)
 
-    # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
+
+def select_files(cur, conn, filepath, func, incremental=False, batch_size=None):
+    """
+    Retrieve paths to the files in specified dir that need loading, and 
+    wrap `func` so every file it loads is recorded in the load manifest. 
+
+    Parameters
+    ----------
+    cur : 
+        psycopg2 cursor object
+    conn : 
+        psycopg2 connection object
+    filepath :
+        absolute or relative path to song or log file
+    func : 
+        function to parse & load file
+    incremental :
+        only return files that are new or changed since they were last 
+        loaded (see `manifest.pending_files`)
+    batch_size :
+        if given, group files into tuples of this many paths, for a `func` 
+        that loads many files per call
+
+    Returns
+    -------
+    (list of file paths or tuples of paths, wrapped func)
+    """
+    all_files = get_files(filepath)
+    print('{} files found in {}'.format(len(all_files), filepath))
+
+    if incremental:
+        all_files = pending_files(cur, all_files)
         conn.commit()
-        print('{}/{} files processed.'.format(i, num_files))
+        print('{} files new or changed since last load'.format(len(all_files)))
+
+    if batch_size:
+        all_files = chunk_files(all_files, batch_size)
 
+    return all_files, partial(load_and_record, func)
 
-def main():
+
+def process_data(cur, conn, filepath, func, policy=None, incremental=False, 
+                 batch_size=None):
+    """
+    Retrieve paths to all files in specified dir, then iterate over all files,
+    passing filepaths to the supplied function. Files are committed in 
+    batches according to `policy`; a file that fails is rolled back on its 
+    own and the rest of its batch is kept. Each loaded file is recorded in 
+    the load manifest. 
+    
+    Parameters
+    ----------
+    cur : 
+        psycopg2 cursor object
+    conn : 
+        psycopg2 connection object
+    filepath :
+        absolute or relative path to song or log file
+    func : 
+        function to parse & load file, returning the number of rows written
+    policy :
+        `batching.CommitPolicy`, defaults to committing after every file
+    incremental :
+        only load files that are new or changed since they were last loaded
+    batch_size :
+        if given, `func` takes a tuple of up to this many file paths per 
+        call instead of a single path
+
+    Returns
+    -------
+    `batching.Progress` with the number of files processed and rows written
+
+    Raises
+    ------
+    RuntimeError
+        One or more files failed to load. 
+    """
+    all_files, func = select_files(
+        cur, conn, filepath, func, incremental, batch_size
+    )
+
+    # iterate over files and process
+    progress = Progress(sum(len(unit_files(unit)) for unit in all_files))
+    errors = {}
+    for datafile, rows, error in load_files(cur, conn, all_files, func, policy):
+        if error is not None:
+            errors[datafile] = error
+        progress.update(rows, len(unit_files(datafile)))
+
+    raise_for_errors(errors)
+    return progress
+
+
+def process_data_parallel(pool, filepath, func, workers, queue_size=None, policy=None, 
+                          incremental=False, batch_size=None):
+    """
+    Retrieve paths to all files in specified dir, then load them with a pool
+    of worker processes, each with its own DB connection. See 
+    `parallel.load_files_parallel` for the ordering guarantees. 
+    
+    Parameters
+    ----------
+    pool :
+        `db.ConnectionPool` for sparkifydb; files are selected on one of 
+        its connections, and workers connect with its DSN
+    filepath :
+        absolute or relative path to song or log file
+    func : 
+        function to parse & load file, must be picklable
+    workers :
+        number of worker processes
+    queue_size :
+        maximum number of file paths queued for the workers
+    policy :
+        `batching.CommitPolicy` each worker commits by
+    incremental :
+        only load files that are new or changed since they were last loaded
+    batch_size :
+        if given, `func` takes a tuple of up to this many file paths per 
+        call instead of a single path
+
+    Returns
+    -------
+    `batching.Progress` with the number of files processed and rows written
+
+    Raises
+    ------
+    RuntimeError
+        One or more files failed to load. 
+    """
+    with pool.connection() as conn:
+        all_files, func = select_files(
+            conn.cursor(), conn, filepath, func, incremental, batch_size
+        )
+
+    progress, errors = load_files_parallel(
+        pool.dsn, all_files, func, workers, queue_size, policy
+    )
+    raise_for_errors(errors)
+    return progress
+
+
+def main(load_mode, workers=1, queue_size=None, policy=None, incremental=False, 
+         song_batch_size=1, log_chunk_size=LOG_CHUNK_SIZE, log_batch_size=1, 
+         data_dir='data', dsn=None, defer_indexes=False, page_size=PAGE_SIZE, 
+         metrics_path=None):
     """
     Connect to DB, run data processing for all song & log files, close DB 
     connection. 
 
+    Parameters
+    ----------
+    load_mode :
+        how rows are written, one of `loaders.LOAD_MODES`
+    workers :
+        number of worker processes loading files; 1 loads every file on 
+        this process's connection
+    queue_size :
+        maximum number of file paths queued for the workers
+    policy :
+        `batching.CommitPolicy` deciding how often loaded files are committed
+    incremental :
+        only load files that are new or changed since they were last loaded
+    song_batch_size :
+        number of song files parsed and loaded together; 1 loads each song 
+        file on its own
+    log_chunk_size :
+        maximum number of log events held in memory at once
+    log_batch_size :
+        number of log files loaded together, with one 'users' upsert per 
+        batch; 1 loads each log file on its own
+    data_dir :
+        directory holding the 'song_data' and 'log_data' trees
+    dsn :
+        connection string for sparkifydb, defaults to `db.get_dsn()`
+    defer_indexes :
+        drop secondary indexes before loading and rebuild them once all 
+        files are loaded, which is faster for large loads
+    page_size :
+        rows per statement or round trip in 'values' and 'prepared' modes
+    metrics_path :
+        if given, write time, rows and bytes per stage of every log file to 
+        this JSON-lines file, replacing its contents, and print a summary 
+        per stage once all log files are loaded
+
     Returns
     -------
-    None
+    dict of stage name -> {'seconds', 'files', 'rows'} for the 'songs', 
+    'song_index', 'logs' and, with `defer_indexes`, 'indexes' stages
     """
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    pool = ConnectionPool(dsn)
+    conn = pool.getconn()
     cur = conn.cursor()
+    stats = {}
+
+    if defer_indexes:
+        for query in drop_index_queries:
+            cur.execute(query)
+        conn.commit()
+
+    def run(stage, filepath, func, batch_size=None):
+        start = time.monotonic()
+        if workers > 1:
+            progress = process_data_parallel(
+                pool, filepath, func, workers, queue_size, policy, incremental, 
+                batch_size
+            )
+        else:
+            progress = process_data(
+                cur, conn, filepath, func, policy, incremental, batch_size
+            )
+        stats[stage] = {
+            'seconds': time.monotonic() - start,
+            'files': progress.files,
+            'rows': progress.rows
+        }
+
+    song_dir = os.path.join(data_dir, 'song_data')
+    log_dir = os.path.join(data_dir, 'log_data')
+
+    # all song files are committed before any log file is read
+    if song_batch_size > 1:
+        run(
+            'songs', 
+            song_dir, 
+            partial(process_song_files, load_mode=load_mode, page_size=page_size), 
+            song_batch_size
+        )
+    else:
+        run('songs', song_dir, process_song_file)
+
+    # look up songs for every play in memory rather than one query per play
+    start = time.monotonic()
+    song_index = SongIndex.from_db(cur)
+    conn.commit()
+    stats['song_index'] = {
+        'seconds': time.monotonic() - start, 
+        'files': 0, 
+        'rows': len(song_index)
+    }
+    print('{} songs indexed'.format(len(song_index)))
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    log_options = dict(
+        load_mode=load_mode, 
+        song_index=song_index, 
+        chunksize=log_chunk_size,
+        time_dim=TimeDimension(),
+        partitions=SongplayPartitions(),
+        page_size=page_size
+    )
+    if metrics_path:
+        # start from an empty file; workers append to it
+        open(metrics_path, 'w').close()
+        log_options['metrics'] = Metrics(metrics_path)
+
+    if log_batch_size > 1:
+        run(
+            'logs', 
+            log_dir, 
+            partial(process_log_files, **log_options), 
+            log_batch_size
+        )
+    else:
+        run('logs', log_dir, partial(process_log_file, **log_options))
+
+    if metrics_path:
+        print_summary(summarize(read_records(metrics_path)))
+
+    if defer_indexes:
+        start = time.monotonic()
+        for query in create_index_queries:
+            cur.execute(query)
+        conn.commit()
+        stats['indexes'] = {'seconds': time.monotonic() - start, 'files': 0, 'rows': 0}
 
-    conn.close()
+    pool.putconn(conn)
+    pool.close()
+    return stats
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Load Sparkify song and log data into sparkifydb"
+    )
+    parser.add_argument(
+        '-m', '--mode',
+        choices=LOAD_MODES,
+        dest="load_mode",
+        default='insert',
+        help="'insert' writes rows one at a time, 'values' with multi-row "
+             "INSERTs, 'prepared' with batches of server-side prepared "
+             "statements, 'copy' bulk loads each file with COPY FROM STDIN "
+             "and set-based merges"
+    )
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        dest="page_size",
+        default=PAGE_SIZE,
+        help="Rows per statement ('values') or per round trip ('prepared') "
+             "(default: {})".format(PAGE_SIZE)
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        dest="workers",
+        default=1,
+        help="Number of worker processes loading files, each with its own "
+             "connection. Song files still all load before log files."
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        dest="queue_size",
+        default=None,
+        help="Maximum number of file paths queued for the workers "
+             "(default: 4 per worker)"
+    )
+    parser.add_argument(
+        '--commit-files',
+        type=int,
+        dest="commit_files",
+        default=None,
+        help="Commit after this many files (default: 1 if no other commit "
+             "limit is given)"
+    )
+    parser.add_argument(
+        '--commit-rows',
+        type=int,
+        dest="commit_rows",
+        default=None,
+        help="Commit after this many rows"
+    )
+    parser.add_argument(
+        '--commit-seconds',
+        type=float,
+        dest="commit_seconds",
+        default=None,
+        help="Commit once a transaction has been open this many seconds"
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        dest="incremental",
+        default=False,
+        help="Only load files that are new or changed since the last run, "
+             "according to the load manifest"
+    )
+    parser.add_argument(
+        '--song-batch',
+        type=int,
+        dest="song_batch_size",
+        default=1,
+        help="Parse and load this many song files at a time, deduplicating "
+             "songs and artists in memory (default: 1)"
+    )
+    parser.add_argument(
+        '--log-chunk-size',
+        type=int,
+        dest="log_chunk_size",
+        default=LOG_CHUNK_SIZE,
+        help="Maximum number of log events held in memory at once "
+             "(default: {})".format(LOG_CHUNK_SIZE)
+    )
+    parser.add_argument(
+        '--log-batch',
+        type=int,
+        dest="log_batch_size",
+        default=1,
+        help="Load this many log files at a time, upserting each user once "
+             "per batch with their latest record (default: 1)"
+    )
+    parser.add_argument(
+        '--defer-indexes',
+        action='store_true',
+        dest="defer_indexes",
+        default=False,
+        help="Drop secondary indexes during the load and rebuild them at the end"
+    )
+    parser.add_argument(
+        '--metrics',
+        dest="metrics_path",
+        default=None,
+        help="Write time, rows and bytes per stage of every log file to this "
+             "JSON-lines file and print a summary per stage"
+    )
+    args = parser.parse_args()
+
+    policy = CommitPolicy(
+        files=args.commit_files, 
+        rows=args.commit_rows, 
+        seconds=args.commit_seconds
+    )
+    main(
+        args.load_mode, 
+        args.workers, 
+        args.queue_size, 
+        policy, 
+        args.incremental, 
+        args.song_batch_size,
+        args.log_chunk_size,
+        args.log_batch_size,
+        defer_indexes=args.defer_indexes,
+        page_size=args.page_size,
+        metrics_path=args.metrics_path
+    )
\ No newline at end of file
@@ -0,0 +1,260 @@
+import os
+import json
+import random
+import string
+import argparse
+from datetime import datetime, timedelta, timezone
+
+PAGES = ["Home", "Logout", "Settings", "Help", "About", "Upgrade", "Downgrade"]
+
+USER_AGENTS = [
+    "\"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36\"",
+    "\"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36\"",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0",
+]
+
+LOCATIONS = [
+    "San Francisco-Oakland-Hayward, CA",
+    "Phoenix-Mesa-Scottsdale, AZ",
+    "New York-Newark-Jersey City, NY-NJ-PA",
+    "Chicago-Naperville-Elgin, IL-IN-WI",
+    "Atlanta-Sandy Springs-Roswell, GA",
+]
+
+
+def random_id(rng, prefix, length=16):
+    """
+    Random id in the style of the Million Song Dataset, e.g. 'SOMZWCG12A8C13C480'.
+    """
+    chars = string.ascii_uppercase + string.digits
+    return prefix + ''.join(rng.choice(chars) for _ in range(length))
+
+
+def random_words(rng, n):
+    """
+    `n` random capitalized words, used for names and titles.
+    """
+    return ' '.join(
+        ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))).title()
+        for _ in range(n)
+    )
+
+
+def generate_songs(output_dir, num_songs, num_artists, rng):
+    """
+    Write `num_songs` song files under `output_dir`/song_data, laid out like
+    the sample data: one JSON object per file, in directories named after
+    the 3rd-5th characters of the track id.
+
+    Parameters
+    ----------
+    output_dir :
+        root directory of the generated data
+    num_songs :
+        number of song files to write
+    num_artists :
+        number of distinct artists the songs are spread over
+    rng :
+        random.Random instance
+
+    Returns
+    -------
+    list of (title, artist name, duration) for every song written
+    """
+    artists = [
+        {
+            "artist_id": random_id(rng, "AR"),
+            "artist_latitude": rng.choice([None, round(rng.uniform(-60, 60), 5)]),
+            "artist_longitude": rng.choice([None, round(rng.uniform(-150, 150), 5)]),
+            "artist_location": rng.choice(LOCATIONS + [""]),
+            "artist_name": random_words(rng, rng.randint(1, 3)),
+        }
+        for _ in range(num_artists)
+    ]
+
+    catalog = []
+    for _ in range(num_songs):
+        track_id = random_id(rng, "TR")
+        song = dict(rng.choice(artists))
+        song.update({
+            "num_songs": 1,
+            "song_id": random_id(rng, "SO"),
+            "title": random_words(rng, rng.randint(1, 5)),
+            "duration": round(rng.uniform(60, 600), 5),
+            "year": rng.choice([0, rng.randint(1960, 2010)]),
+        })
+
+        song_dir = os.path.join(output_dir, "song_data", *track_id[2:5])
+        os.makedirs(song_dir, exist_ok=True)
+        with open(os.path.join(song_dir, track_id + ".json"), "w") as f:
+            json.dump(song, f)
+
+        catalog.append((song["title"], song["artist_name"], song["duration"]))
+
+    return catalog
+
+
+def generate_logs(output_dir, catalog, num_events, num_days, num_users, rng,
+                  match_rate=0.5, nextsong_rate=0.8, start=datetime(2018, 11, 1, tzinfo=timezone.utc)):
+    """
+    Write `num_events` log events under `output_dir`/log_data, one JSON-lines
+    file per day, laid out like the sample data. Files are written a line
+    at a time; only one day's event timestamps are held in memory.
+
+    Parameters
+    ----------
+    output_dir :
+        root directory of the generated data
+    catalog :
+        list of (title, artist name, duration) songs that plays may refer to
+    num_events :
+        total number of events to write
+    num_days :
+        number of daily log files to spread the events over
+    num_users :
+        number of distinct users
+    rng :
+        random.Random instance
+    match_rate :
+        fraction of song plays that refer to a song in `catalog`
+    nextsong_rate :
+        fraction of events that are song plays ('NextSong' page)
+    start :
+        date of the first log file
+
+    Returns
+    -------
+    None
+    """
+    users = [
+        {
+            "userId": str(user_id),
+            "firstName": random_words(rng, 1),
+            "lastName": random_words(rng, 1),
+            "gender": rng.choice(["M", "F"]),
+            "level": rng.choice(["free", "paid"]),
+            "location": rng.choice(LOCATIONS),
+            "userAgent": rng.choice(USER_AGENTS),
+            "registration": float(int((start - timedelta(days=rng.randint(1, 365))).timestamp() * 1000)),
+            "sessionId": user_id * 1000,
+            "itemInSession": 0,
+        }
+        for user_id in range(1, num_users + 1)
+    ]
+
+    per_day, extra = divmod(num_events, num_days)
+    for day in range(num_days):
+        date = start + timedelta(days=day)
+        day_events = per_day + (1 if day < extra else 0)
+
+        log_dir = os.path.join(output_dir, "log_data", date.strftime("%Y"), date.strftime("%m"))
+        os.makedirs(log_dir, exist_ok=True)
+        log_path = os.path.join(log_dir, date.strftime("%Y-%m-%d") + "-events.json")
+
+        day_ms = int(date.timestamp() * 1000)
+        offsets = sorted(rng.randrange(86400 * 1000) for _ in range(day_events))
+
+        with open(log_path, "w") as f:
+            for offset in offsets:
+                user = rng.choice(users)
+                # start a new session every so often
+                if rng.random() < 0.05:
+                    user["sessionId"] += 1
+                    user["itemInSession"] = 0
+                    # users occasionally change subscription level
+                    if rng.random() < 0.1:
+                        user["level"] = "paid" if user["level"] == "free" else "free"
+
+                if rng.random() < nextsong_rate:
+                    page = "NextSong"
+                    if catalog and rng.random() < match_rate:
+                        song, artist, length = rng.choice(catalog)
+                    else:
+                        song = random_words(rng, rng.randint(1, 5))
+                        artist = random_words(rng, rng.randint(1, 3))
+                        length = round(rng.uniform(60, 600), 5)
+                else:
+                    page = rng.choice(PAGES)
+                    song = artist = length = None
+
+                event = {
+                    "artist": artist,
+                    "auth": "Logged In",
+                    "firstName": user["firstName"],
+                    "gender": user["gender"],
+                    "itemInSession": user["itemInSession"],
+                    "lastName": user["lastName"],
+                    "length": length,
+                    "level": user["level"],
+                    "location": user["location"],
+                    "method": "PUT" if page == "NextSong" else "GET",
+                    "page": page,
+                    "registration": user["registration"],
+                    "sessionId": user["sessionId"],
+                    "song": song,
+                    "status": 200,
+                    "ts": day_ms + offset,
+                    "userAgent": user["userAgent"],
+                    "userId": user["userId"],
+                }
+                user["itemInSession"] += 1
+                f.write(json.dumps(event) + "\n")
+
+
+def main(output_dir, num_songs, num_artists, num_events, num_days, num_users,
+         match_rate, nextsong_rate, seed):
+    """
+    Generate a song_data and log_data tree with the same JSON layout as the
+    sample data in `data/`.
+
+    Returns
+    -------
+    None
+    """
+    rng = random.Random(seed)
+
+    catalog = generate_songs(output_dir, num_songs, num_artists, rng)
+    print('{} song files written to {}'.format(num_songs, output_dir))
+
+    generate_logs(
+        output_dir, catalog, num_events, num_days, num_users, rng,
+        match_rate, nextsong_rate
+    )
+    print('{} events in {} log files written to {}'.format(num_events, num_days, output_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic Sparkify song and log data"
+    )
+    parser.add_argument('-o', '--output', dest="output_dir", default='bench_data',
+                        help="Directory to write song_data and log_data into")
+    parser.add_argument('--songs', type=int, dest="num_songs", default=1000,
+                        help="Number of song files")
+    parser.add_argument('--artists', type=int, dest="num_artists", default=None,
+                        help="Number of distinct artists (default: songs / 4)")
+    parser.add_argument('--events', type=int, dest="num_events", default=10000,
+                        help="Total number of log events")
+    parser.add_argument('--days', type=int, dest="num_days", default=30,
+                        help="Number of daily log files")
+    parser.add_argument('--users', type=int, dest="num_users", default=100,
+                        help="Number of distinct users")
+    parser.add_argument('--match-rate', type=float, dest="match_rate", default=0.5,
+                        help="Fraction of song plays that match a generated song")
+    parser.add_argument('--nextsong-rate', type=float, dest="nextsong_rate", default=0.8,
+                        help="Fraction of events that are song plays")
+    parser.add_argument('--seed', type=int, dest="seed", default=0,
+                        help="Random seed")
+    args = parser.parse_args()
+
+    main(
+        args.output_dir,
+        args.num_songs,
+        args.num_artists or max(1, args.num_songs // 4),
+        args.num_events,
+        args.num_days,
+        args.num_users,
+        args.match_rate,
+        args.nextsong_rate,
+        args.seed
+    )
@@ -0,0 +1,174 @@
+import io
+import re
+import hashlib
+
+from psycopg2.extras import execute_batch, execute_values
+
+from sql_queries import (
+    staging_copy,
+    staging_truncate,
+    time_staging_create,
+    time_table_merge,
+    user_staging_create,
+    user_table_merge,
+    song_staging_create,
+    song_table_merge,
+    artist_staging_create,
+    artist_table_merge,
+    songplay_staging_create,
+    songplay_table_merge
+)
+
+LOAD_MODES = ('insert', 'values', 'prepared', 'copy')
+
+# rows sent per statement (values) or per round trip (prepared)
+PAGE_SIZE = 1000
+
+# the single-row VALUES list of an INSERT in `sql_queries.py`
+VALUES_LIST = re.compile(r"VALUES\s*\(\s*%s(?:\s*,\s*%s)*\s*\)")
+
+# Marks missing values in COPY data. With the CSV default (an unquoted empty
+# field) empty strings would load as NULL, unlike with INSERT.
+COPY_NULL = r'\N'
+
+# target table -> (staging table, staging DDL, merge statement)
+STAGING_TABLES = {
+    'time': ('time_staging', time_staging_create, time_table_merge),
+    'users': ('users_staging', user_staging_create, user_table_merge),
+    'songs': ('songs_staging', song_staging_create, song_table_merge),
+    'artists': ('artists_staging', artist_staging_create, artist_table_merge),
+    'songplays': ('songplays_staging', songplay_staging_create, songplay_table_merge),
+}
+
+
+def frame_records(df):
+    """
+    Convert a DataFrame into a list of row tuples holding plain Python
+    objects, which psycopg2 can adapt (numpy scalars it cannot).
+    Missing values become None.
+
+    Parameters
+    ----------
+    df :
+        pandas DataFrame
+
+    Returns
+    -------
+    list of tuples
+    """
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def values_query(query):
+    """
+    Turn a single-row INSERT from `sql_queries.py` into one taking many rows
+    through `psycopg2.extras.execute_values`, by replacing its
+    `VALUES (%s, ...)` list with `VALUES %s`.
+
+    Parameters
+    ----------
+    query :
+        parameterized INSERT statement
+
+    Returns
+    -------
+    str
+    """
+    values_sql, count = VALUES_LIST.subn('VALUES %s', query)
+    if count != 1:
+        raise ValueError('Expected one VALUES list in query: {}'.format(query))
+    return values_sql
+
+
+def statement_name(query):
+    """
+    Name under which `query` is PREPAREd, the same for every connection and
+    every run.
+    """
+    return 'stmt_' + hashlib.md5(query.encode()).hexdigest()[:16]
+
+
+def insert_frame(cur, df, query, load_mode='insert', page_size=PAGE_SIZE):
+    """
+    Insert a DataFrame using `query`. Columns of `df` must be in the same
+    order as the query's placeholders.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+    df :
+        pandas DataFrame of rows to insert
+    query :
+        parameterized single-row INSERT statement from `sql_queries.py`
+    load_mode :
+        'insert' executes `query` once per row; 'values' sends `page_size`
+        rows per multi-row INSERT; 'prepared' PREPAREs `query` once per
+        connection (see `db.PreparingConnection`) and sends `page_size`
+        EXECUTEs per round trip
+    page_size :
+        rows per statement or round trip, for 'values' and 'prepared'
+
+    Returns
+    -------
+    None
+    """
+    records = frame_records(df)
+    if not records:
+        return
+
+    if load_mode == 'values':
+        execute_values(cur, values_query(query), records, page_size=page_size)
+    elif load_mode == 'prepared':
+        execute = cur.connection.prepare(cur, statement_name(query), query)
+        execute_batch(cur, execute, records, page_size=page_size)
+    else:
+        for record in records:
+            cur.execute(query, record)
+
+
+def copy_frame(cur, df, table, target=None):
+    """
+    Bulk load a DataFrame into `table`: stream it into a temporary staging
+    table with COPY FROM STDIN, then merge the staging table into `table`
+    with one set-based INSERT. Conflict handling matches the row-by-row
+    insert statements.
+
+    Columns of `df` must be named after the staging table's columns.
+    `target` names the table to merge into if it is not `table` itself,
+    e.g. one partition of a partitioned table.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+    df :
+        pandas DataFrame of rows to load
+    table :
+        name of the target table, a key of `STAGING_TABLES`
+    target :
+        optional table to merge into instead, such as a partition of `table`
+
+    Returns
+    -------
+    None
+    """
+    staging, staging_create, merge = STAGING_TABLES[table]
+
+    cur.execute(staging_create)
+    cur.execute(staging_truncate.format(table=staging))
+
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep=COPY_NULL)
+    buf.seek(0)
+
+    cur.copy_expert(
+        staging_copy.format(
+            table=staging, 
+            columns=', '.join(df.columns), 
+            null=COPY_NULL
+        ),
+        buf
+    )
+    cur.execute(merge.format(table=target or table))
@@ -0,0 +1,160 @@
+import os
+import hashlib
+
+from batching import unit_files
+from sql_queries import (
+    manifest_table_create,
+    manifest_entry_select,
+    manifest_select,
+    manifest_stat_update,
+    manifest_table_upsert,
+    songplay_file_delete
+)
+
+
+def file_stat(filepath):
+    """
+    Size and modification time of a file.
+
+    Parameters
+    ----------
+    filepath :
+        path to file
+
+    Returns
+    -------
+    (size in bytes, mtime as seconds since the epoch)
+    """
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    """
+    SHA-256 hex digest of a file's contents.
+
+    Parameters
+    ----------
+    filepath :
+        path to file
+    chunk_size :
+        bytes read at a time
+
+    Returns
+    -------
+    str
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pending_files(cur, all_files):
+    """
+    Filter `all_files` down to those that are not yet in the load manifest,
+    or whose contents changed since they were loaded.
+
+    A file whose size and mtime match its manifest entry is skipped without
+    being read. If only the stat differs (e.g. the file was touched or
+    copied), the file is hashed; when the hash still matches, the file is
+    skipped and its manifest entry refreshed so it is not hashed again.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+    all_files :
+        list of file paths
+
+    Returns
+    -------
+    list of file paths to load
+    """
+    cur.execute(manifest_table_create)
+    cur.execute(manifest_select)
+    manifest = {
+        filepath: (size, mtime, content_hash)
+        for filepath, size, mtime, content_hash in cur.fetchall()
+    }
+
+    pending = []
+    for datafile in all_files:
+        entry = manifest.get(datafile)
+        if entry is None:
+            pending.append(datafile)
+            continue
+
+        size, mtime, content_hash = entry
+        stat = file_stat(datafile)
+        if stat == (size, mtime):
+            continue
+
+        if file_hash(datafile) == content_hash:
+            cur.execute(manifest_stat_update, stat + (datafile,))
+        else:
+            pending.append(datafile)
+
+    return pending
+
+
+def record_file(cur, filepath):
+    """
+    Record a loaded file in the load manifest.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+    filepath :
+        path to the file that was loaded
+
+    Returns
+    -------
+    None
+    """
+    size, mtime = file_stat(filepath)
+    cur.execute(
+        manifest_table_upsert,
+        (filepath, size, mtime, file_hash(filepath))
+    )
+
+
+def load_and_record(func, cur, filepath):
+    """
+    Load a file with `func`, then record it in the load manifest in the
+    same transaction, so a file only counts as loaded once its rows are
+    committed. Wrap with functools.partial to get a function with the
+    usual func(cur, filepath) signature.
+
+    A file that is already in the manifest is being loaded again because
+    its contents changed: the song plays it loaded before are deleted
+    first, in the same transaction, so they are replaced rather than
+    counted twice. Dimension rows are upserted and need no such step.
+
+    `filepath` may also be a tuple of paths for functions that load many
+    files at once, in which case each of them is recorded.
+
+    Parameters
+    ----------
+    func :
+        function to parse & load file
+    cur :
+        psycopg2 cursor object
+    filepath :
+        path to file, or tuple of paths
+
+    Returns
+    -------
+    number of rows written by `func`
+    """
+    for datafile in unit_files(filepath):
+        cur.execute(manifest_entry_select, (datafile,))
+        if cur.fetchone() is not None:
+            cur.execute(songplay_file_delete, (datafile,))
+
+    rows = func(cur, filepath)
+    for datafile in unit_files(filepath):
+        record_file(cur, datafile)
+    return rows
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+
+class StageRecord:
+    """
+    Rows and bytes handled by one run of a stage, filled in by the code
+    being timed.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+
+class Metrics:
+    """
+    Times the stages of the log ETL and counts the rows and bytes each one
+    handles. Stage runs are summed per unit of work - a log file, or a
+    batch of them for stages run once per batch - by `flush`, and written
+    out by `commit` as one JSON line per stage, e.g.
+
+        {"unit": ["log.json"], "stage": "parse", "seconds": 0.01,
+         "rows": 100, "bytes": 20480, "pid": 1234}
+
+    Totals per stage are kept in memory (`summary`) and, if `path` is
+    given, every record is appended to that file. Records are held back
+    until `commit`, so the stages of a batch whose rows are rolled back
+    can still be dropped with `discard`. Worker processes each
+    hold a copy of this object and append to the same file, so the totals
+    of a parallel run are read back from the file with `read_records`.
+
+    Parameters
+    ----------
+    path :
+        JSON-lines file to append records to
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.summary = {}
+        self._pending = {}
+        self._records = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as a run of stage `name`.
+
+        Yields
+        ------
+        `StageRecord` to set the rows and bytes handled on
+        """
+        record = StageRecord()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            totals = self._pending.setdefault(name, [0.0, 0, 0])
+            totals[0] += time.perf_counter() - start
+            totals[1] += record.rows
+            totals[2] += record.bytes
+
+    def flush(self, unit):
+        """
+        Record the stages run since the last flush against `unit`. The
+        records are written by the next `commit`.
+
+        Parameters
+        ----------
+        unit :
+            file path, or tuple of file paths, the stages ran for
+
+        Returns
+        -------
+        None
+        """
+        unit = list(unit) if isinstance(unit, tuple) else [unit]
+        self._records.extend(
+            {
+                'unit': unit,
+                'stage': name,
+                'seconds': seconds,
+                'rows': rows,
+                'bytes': num_bytes,
+                'pid': os.getpid()
+            }
+            for name, (seconds, rows, num_bytes) in self._pending.items()
+        )
+        self._pending = {}
+
+    def commit(self):
+        """Add the records flushed since the last commit to `summary` and `path`."""
+        records, self._records = self._records, []
+        for record in records:
+            add_record(self.summary, record)
+
+        if self.path and records:
+            # a single append per commit keeps lines from workers whole
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in records))
+
+    def discard(self):
+        """
+        Drop the stages run and the records flushed since the last commit,
+        e.g. for a failed batch.
+        """
+        self._pending = {}
+        self._records = []
+
+
+def add_record(summary, record):
+    """
+    Add a stage record to the totals in `summary`, a dict of stage name ->
+    {'seconds', 'rows', 'bytes', 'units'}.
+    """
+    totals = summary.setdefault(
+        record['stage'], {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'units': 0}
+    )
+    totals['seconds'] += record['seconds']
+    totals['rows'] += record['rows']
+    totals['bytes'] += record['bytes']
+    totals['units'] += 1
+
+
+def summarize(records):
+    """
+    Sum stage records over all units.
+
+    Parameters
+    ----------
+    records :
+        iterable of records as written by `Metrics.commit`
+
+    Returns
+    -------
+    dict of stage name -> {'seconds', 'rows', 'bytes', 'units'}, in the
+    order stages first appear
+    """
+    summary = {}
+    for record in records:
+        add_record(summary, record)
+    return summary
+
+
+def read_records(path):
+    """
+    Read the records of a JSON-lines metrics file.
+
+    Yields
+    ------
+    record dict
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def print_summary(summary):
+    """
+    Print a table of time, share of time, rows and bytes per stage.
+    """
+    total = sum(stage['seconds'] for stage in summary.values()) or float('nan')
+    print('{:<16} {:>10} {:>7} {:>11} {:>12} {:>11}'.format(
+        'stage', 'seconds', '%', 'rows', 'rows/sec', 'MB'
+    ))
+    for name, stage in summary.items():
+        seconds = stage['seconds'] or float('nan')
+        print('{:<16} {:>10.3f} {:>6.1f}% {:>11} {:>12.0f} {:>11.2f}'.format(
+            name,
+            stage['seconds'],
+            100 * stage['seconds'] / total,
+            stage['rows'],
+            stage['rows'] / seconds,
+            stage['bytes'] / 1e6
+        ))
@@ -0,0 +1,143 @@
+import queue
+import multiprocessing as mp
+
+from db import connect
+from batching import CommitPolicy, Progress, load_files, unit_files
+
+# seconds to wait on a queue before checking the workers are still alive
+POLL_INTERVAL = 1
+
+
+def _worker(dsn, func, file_queue, done_queue, policy):
+    """
+    Worker process loop: open a connection of its own, then load files
+    from `file_queue` until a None sentinel arrives. Statements prepared
+    on the connection are reused by every file the worker loads. Files are committed in
+    batches according to `policy`; a file that fails is rolled back to its
+    savepoint and reported rather than stopping the worker.
+
+    Parameters
+    ----------
+    dsn :
+        libpq connection string
+    func :
+        function to parse & load a file, called as func(cur, filepath)
+    file_queue :
+        bounded queue of file paths to load
+    done_queue :
+        queue of (filepath, rows written, error message or None) results
+    policy :
+        `batching.CommitPolicy` deciding when to commit
+
+    Returns
+    -------
+    None
+    """
+    conn = connect(dsn)
+    cur = conn.cursor()
+
+    files = iter(file_queue.get, None)
+    for result in load_files(cur, conn, files, func, policy):
+        done_queue.put(result)
+
+    conn.close()
+
+
+def _check_alive(procs):
+    if not any(p.is_alive() for p in procs):
+        raise RuntimeError('All ETL worker processes have exited.')
+
+
+def load_files_parallel(dsn, all_files, func, workers, queue_size=None, policy=None):
+    """
+    Load files with a pool of worker processes, each with its own
+    connection, fed from one bounded queue of file paths.
+
+    Ordering guarantees:
+
+    * Every file has been committed (or has failed) by the time this
+      returns, so calling it once per data set - song files, then log
+      files - keeps all songs loaded before any log file starts.
+    * Within a call, files are committed in no particular order. Row order
+      in 'songplays' (and so songplay_id) does not follow file order, and
+      when several files upsert the same user the last file to commit
+      decides `users.level`.
+
+    Parameters
+    ----------
+    dsn :
+        libpq connection string
+    all_files :
+        list of file paths to load, or of tuples of paths (see
+        `batching.chunk_files`)
+    func :
+        function to parse & load a file, called as func(cur, filepath).
+        Must be picklable, e.g. a module-level function or a
+        functools.partial of one.
+    workers :
+        number of worker processes
+    queue_size :
+        maximum number of file paths waiting in the queue, defaults to
+        four per worker
+    policy :
+        `batching.CommitPolicy` each worker commits by, defaults to
+        committing after every file
+
+    Returns
+    -------
+    (`batching.Progress` of the files processed, dict of filepath -> error
+    message for every file that failed to load)
+    """
+    num_files = sum(len(unit_files(unit)) for unit in all_files)
+    file_queue = mp.Queue(maxsize=queue_size or 4 * workers)
+    done_queue = mp.Queue()
+
+    procs = [
+        mp.Process(
+            target=_worker,
+            args=(dsn, func, file_queue, done_queue, policy or CommitPolicy())
+        )
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+
+    errors = {}
+    progress = Progress(num_files)
+
+    def collect(block):
+        while progress.files < num_files:
+            try:
+                datafile, rows, error = done_queue.get(block, POLL_INTERVAL)
+            except queue.Empty:
+                return
+            if error is not None:
+                errors[datafile] = error
+            progress.update(rows, len(unit_files(datafile)))
+
+    try:
+        # feed the workers, draining results whenever the queue is full
+        for datafile in all_files + [None] * workers:
+            while True:
+                try:
+                    file_queue.put(datafile, timeout=POLL_INTERVAL)
+                    break
+                except queue.Full:
+                    collect(block=False)
+                    _check_alive(procs)
+
+        while progress.files < num_files:
+            collect(block=True)
+            if progress.files < num_files:
+                _check_alive(procs)
+    finally:
+        for p in procs:
+            if progress.files < num_files:
+                p.terminate()
+            p.join()
+
+    # workers commit their last batch after reporting its files
+    if any(p.exitcode != 0 for p in procs):
+        raise RuntimeError('An ETL worker exited before committing its last batch.')
+
+    return progress, errors
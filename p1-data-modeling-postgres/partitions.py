@@ -0,0 +1,224 @@
+import re
+import argparse
+
+import pandas as pd
+
+from db import connect
+from sql_queries import (
+    partition_create_lock,
+    partition_exists_select,
+    songplay_partition_create,
+    songplay_partition_detach,
+    songplay_partitions_select
+)
+
+
+def partition_name(month):
+    """
+    Name of the songplays partition holding `month`, e.g. 'songplays_2018_11'.
+
+    Parameters
+    ----------
+    month :
+        pandas Period with monthly frequency
+
+    Returns
+    -------
+    str
+    """
+    return 'songplays_{:04d}_{:02d}'.format(month.year, month.month)
+
+
+class SongplayPartitions:
+    """
+    Creates monthly partitions of 'songplays' as the ETL meets new months,
+    and splits song plays by the partition they belong to, so that each
+    month's rows are written straight into its partition.
+
+    Partitions this object created are remembered so the catalog is not
+    queried again. Wrap each unit of work that may be rolled back in
+    `begin` and, if it is, `rollback`, so the months it met are looked up
+    again.
+    """
+
+    def __init__(self):
+        self._known = set()
+        # months added to `_known` since `begin`
+        self._unit = []
+
+    def begin(self):
+        """Start a unit of work whose partitions may be rolled back."""
+        self._unit = []
+
+    def rollback(self):
+        """Forget the months met since `begin`, after their transaction was rolled back."""
+        self.forget(self._unit)
+        self._unit = []
+
+    def ensure(self, cur, month):
+        """
+        Create the partition for `month` if it does not exist yet.
+
+        A loader about to create a partition first takes a transaction-level
+        advisory lock and checks again, so when several loaders meet the
+        same new month, the others wait for the creating transaction to end
+        and then find the partition instead of failing on a duplicate table.
+
+        Parameters
+        ----------
+        cur :
+            psycopg2 cursor object
+        month :
+            pandas Period with monthly frequency
+
+        Returns
+        -------
+        name of the partition
+        """
+        name = partition_name(month)
+        if month in self._known:
+            return name
+
+        if not self._exists(cur, name):
+            cur.execute(partition_create_lock)
+            if not self._exists(cur, name):
+                cur.execute(
+                    songplay_partition_create.format(partition=name),
+                    (month.start_time, (month + 1).start_time)
+                )
+        self._known.add(month)
+        self._unit.append(month)
+        return name
+
+    @staticmethod
+    def _exists(cur, name):
+        cur.execute(partition_exists_select, (name,))
+        return cur.fetchone()[0]
+
+    def split(self, cur, df):
+        """
+        Group song plays by month, creating partitions as needed.
+
+        Parameters
+        ----------
+        cur :
+            psycopg2 cursor object
+        df :
+            pandas DataFrame of song plays with a datetime64 'start_time'
+
+        Yields
+        ------
+        (partition name, month, DataFrame of the song plays in that month)
+        """
+        months = df["start_time"].dt.to_period("M")
+        for month, month_df in df.groupby(months, sort=True):
+            yield self.ensure(cur, month), month, month_df
+
+    def forget(self, months):
+        """
+        Forget that partitions exist, e.g. after their creation was rolled back.
+
+        Parameters
+        ----------
+        months :
+            iterable of pandas Periods
+
+        Returns
+        -------
+        None
+        """
+        self._known.difference_update(months)
+
+
+def list_partitions(cur):
+    """
+    All partitions of 'songplays' with the month each one holds.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+
+    Returns
+    -------
+    list of (partition name, pandas Period) sorted by month
+    """
+    cur.execute(songplay_partitions_select)
+    partitions = []
+    for name, bound in cur.fetchall():
+        start = re.search(r"FROM \('([^']+)'\)", bound).group(1)
+        partitions.append((name, pd.Period(start, freq="M")))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def detach_partitions(cur, conn, before, drop=False):
+    """
+    Detach every songplays partition for a month before `before`. Detaching
+    is a catalog change, so old months leave the table instantly instead of
+    being deleted row by row. Detached partitions are kept as ordinary
+    tables unless `drop` is set.
+
+    Parameters
+    ----------
+    cur :
+        psycopg2 cursor object
+    conn :
+        psycopg2 connection object
+    before :
+        pandas Period; months before this one are detached
+    drop :
+        drop detached partitions instead of keeping them
+
+    Returns
+    -------
+    list of names of the partitions detached
+    """
+    detached = []
+    for name, month in list_partitions(cur):
+        if month >= before:
+            continue
+        cur.execute(songplay_partition_detach.format(partition=name))
+        if drop:
+            cur.execute("DROP TABLE {}".format(name))
+        detached.append(name)
+
+    conn.commit()
+    return detached
+
+
+def main(before, drop):
+    """
+    Detach (and optionally drop) the songplays partitions for months before
+    `before`.
+
+    Returns
+    -------
+    None
+    """
+    conn = connect()
+    cur = conn.cursor()
+
+    for name in detach_partitions(cur, conn, pd.Period(before, freq="M"), drop):
+        print('{} {}'.format('Dropped' if drop else 'Detached', name))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Retire old months of songplays by detaching their partitions"
+    )
+    parser.add_argument(
+        'before',
+        help="First month to keep, as YYYY-MM; all earlier months are detached"
+    )
+    parser.add_argument(
+        '--drop',
+        action='store_true',
+        dest="drop",
+        default=False,
+        help="Drop the detached partitions instead of keeping them as tables"
+    )
+    args = parser.parse_args()
+
+    main(args.before, args.drop)
@@ -0,0 +1,135 @@
+import pandas as pd
+
+from sql_queries import song_lookup_select
+
+
+class SongIndex:
+    """
+    In-memory lookup of (song title, artist name, duration) to
+    (song_id, artist_id), standing in for one `song_select` query per
+    song play.
+
+    Where several songs share a key, the first one added wins, as with the
+    `fetchone()` of the row-by-row lookup.
+    """
+
+    KEY_COLS = ['title', 'artist_name', 'duration']
+    ID_COLS = ['song_id', 'artist_id']
+
+    def __init__(self):
+        self._lookup = {}
+        self._frame = None
+
+    @classmethod
+    def from_db(cls, cur, itersize=10000):
+        """
+        Build an index from everything already loaded into 'songs' and
+        'artists'. Rows are streamed through a server-side cursor so the
+        whole catalog never sits in the client twice.
+
+        Parameters
+        ----------
+        cur :
+            psycopg2 cursor object
+        itersize :
+            rows fetched per round trip
+
+        Returns
+        -------
+        SongIndex
+        """
+        index = cls()
+        with cur.connection.cursor(name='song_index') as lookup_cur:
+            lookup_cur.itersize = itersize
+            lookup_cur.execute(song_lookup_select)
+            for title, artist_name, duration, song_id, artist_id in lookup_cur:
+                index.add(title, artist_name, duration, song_id, artist_id)
+        return index
+
+    def __len__(self):
+        return len(self._lookup)
+
+    @staticmethod
+    def _key(title, artist_name, duration):
+        # durations come back from Postgres as Decimal, but from JSON as float
+        return (title, artist_name, None if duration is None else float(duration))
+
+    def add(self, title, artist_name, duration, song_id, artist_id):
+        """
+        Add a single song to the index.
+
+        Parameters
+        ----------
+        title :
+            song title
+        artist_name :
+            name of the song's artist
+        duration :
+            song length in seconds
+        song_id :
+            id of the song in 'songs'
+        artist_id :
+            id of the artist in 'artists'
+
+        Returns
+        -------
+        None
+        """
+        key = self._key(title, artist_name, duration)
+        if key not in self._lookup:
+            self._lookup[key] = (song_id, artist_id)
+            self._frame = None
+
+    def get(self, title, artist_name, duration):
+        """
+        Look up a single song.
+
+        Returns
+        -------
+        (song_id, artist_id), or (None, None) if the song is unknown
+        """
+        return self._lookup.get(
+            self._key(title, artist_name, duration),
+            (None, None)
+        )
+
+    def frame(self):
+        """
+        The index as a DataFrame with one row per key, rebuilt only after
+        new songs have been added.
+
+        Returns
+        -------
+        pandas DataFrame with columns `KEY_COLS` + `ID_COLS`
+        """
+        if self._frame is None:
+            self._frame = pd.DataFrame(
+                [key + ids for key, ids in self._lookup.items()],
+                columns=self.KEY_COLS + self.ID_COLS
+            ).astype({'duration': float})
+        return self._frame
+
+    def resolve(self, df, title_col='song', artist_col='artist', duration_col='length'):
+        """
+        Resolve song and artist ids for every row of a log DataFrame with
+        one vectorized merge.
+
+        Parameters
+        ----------
+        df :
+            pandas DataFrame of song plays
+        title_col, artist_col, duration_col :
+            columns of `df` holding the lookup key
+
+        Returns
+        -------
+        pandas DataFrame with columns `ID_COLS`, aligned to the index of `df`;
+        ids are None where no song matched
+        """
+        keys = df[[title_col, artist_col, duration_col]].copy()
+        keys.columns = self.KEY_COLS
+        keys[self.KEY_COLS[-1]] = keys[self.KEY_COLS[-1]].astype(float)
+
+        ids = keys.merge(self.frame(), how='left', on=self.KEY_COLS)[self.ID_COLS]
+        ids.index = df.index
+        return ids.astype(object).where(ids.notna(), None)
@@ -1,16 +1,19 @@
 # DROP TABLES
 
-songplay_table_drop = "DROP TABLE IF EXISTS songplay"
+songplay_table_drop = "DROP TABLE IF EXISTS songplays"
 user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+manifest_table_drop = "DROP TABLE IF EXISTS load_manifest"
 
 # CREATE TABLES
 
+# Partitioned by month of start_time, one table per month (see PARTITIONS).
+# The primary key of a partitioned table must include the partition key.
 songplay_table_create = ("""
-    CREATE TABLE songplays (
-        songplay_id SERIAL PRIMARY KEY,
+    CREATE TABLE IF NOT EXISTS songplays (
+        songplay_id SERIAL,
         start_time TIMESTAMP NOT NULL,
         user_id INT NOT NULL,
         level TEXT,
@@ -18,12 +21,19 @@ songplay_table_create = ("""
         artist_id TEXT,
         session_id INT,
         location TEXT,
-        user_agent TEXT
-    )
+        user_agent TEXT,
+        source_file TEXT,
+        PRIMARY KEY (songplay_id, start_time)
+    ) PARTITION BY RANGE (start_time)
+""")
+
+# Databases created before song plays recorded their log file
+songplay_source_file_add = ("""
+    ALTER TABLE songplays ADD COLUMN IF NOT EXISTS source_file TEXT
 """)
 
 user_table_create = ("""
-    CREATE TABLE users (
+    CREATE TABLE IF NOT EXISTS users (
         user_id INT PRIMARY KEY,
         first_name TEXT,
         last_name TEXT,
@@ -33,7 +43,7 @@ user_table_create = ("""
 """)
 
 song_table_create = ("""
-    CREATE TABLE songs (
+    CREATE TABLE IF NOT EXISTS songs (
         song_id TEXT PRIMARY KEY,
         title TEXT,
         artist_id TEXT NOT NULL,
@@ -43,7 +53,7 @@ song_table_create = ("""
 """)
 
 artist_table_create = ("""
-    CREATE TABLE artists (
+    CREATE TABLE IF NOT EXISTS artists (
         artist_id TEXT PRIMARY KEY,
         name TEXT,
         location TEXT,
@@ -53,7 +63,7 @@ artist_table_create = ("""
 """)
 
 time_table_create = ("""
-    CREATE TABLE time (
+    CREATE TABLE IF NOT EXISTS time (
         start_time TIMESTAMP PRIMARY KEY,
         hour INT,
         day INT,
@@ -64,8 +74,97 @@ time_table_create = ("""
     )
 """)
 
+# Every file loaded so far, so that incremental runs can skip files
+# that have not changed since they were loaded.
+manifest_table_create = ("""
+    CREATE TABLE IF NOT EXISTS load_manifest (
+        filepath TEXT PRIMARY KEY,
+        size BIGINT NOT NULL,
+        mtime DOUBLE PRECISION NOT NULL,
+        content_hash TEXT NOT NULL,
+        loaded_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+""")
+
+# PARTITIONS
+
+songplay_partition_create = ("""
+    CREATE TABLE IF NOT EXISTS {partition}
+    PARTITION OF songplays
+    FOR VALUES FROM (%s) TO (%s)
+""")
+
+songplay_partition_detach = "ALTER TABLE songplays DETACH PARTITION {partition}"
+
+# Every partition of songplays with its bounds, e.g.
+# 'FOR VALUES FROM (...) TO (...)'.
+songplay_partitions_select = ("""
+    SELECT 
+        child.relname,
+        pg_get_expr(child.relpartbound, child.oid)
+    FROM pg_inherits
+    JOIN pg_class parent
+        ON pg_inherits.inhparent = parent.oid
+    JOIN pg_class child
+        ON pg_inherits.inhrelid = child.oid
+    WHERE parent.relname = 'songplays'
+    ORDER BY child.relname
+""")
+
+partition_exists_select = "SELECT to_regclass(%s) IS NOT NULL"
+
+# Serializes partition creation across loaders until the creating
+# transaction ends; CREATE TABLE IF NOT EXISTS is not safe under concurrency.
+partition_create_lock = "SELECT pg_advisory_xact_lock(hashtext('songplays partitions'))"
+
+# INDEXES
+
+# Secondary indexes, created after the tables. They can be dropped ahead of
+# a large load and rebuilt once it is done (see `etl.py --defer-indexes`),
+# which is much cheaper than maintaining them row by row.
+
+# the (title, artist name, duration) lookup of `song_select`
+song_lookup_index_create = ("""
+    CREATE INDEX IF NOT EXISTS songs_title_duration_idx 
+    ON songs (title, duration, artist_id)
+""")
+
+artist_lookup_index_create = ("""
+    CREATE INDEX IF NOT EXISTS artists_name_idx 
+    ON artists (name, artist_id)
+""")
+
+# Song plays arrive roughly in time order, so a BRIN index summarizing
+# block ranges serves time-range scans at a tiny fraction of a B-tree's size.
+songplay_start_time_index_create = ("""
+    CREATE INDEX IF NOT EXISTS songplays_start_time_brin 
+    ON songplays USING BRIN (start_time)
+""")
+
+song_lookup_index_drop = "DROP INDEX IF EXISTS songs_title_duration_idx"
+artist_lookup_index_drop = "DROP INDEX IF EXISTS artists_name_idx"
+songplay_start_time_index_drop = "DROP INDEX IF EXISTS songplays_start_time_brin"
+
 # INSERT RECORDS
 
+# Song plays are written straight into their month's partition, see
+# `partitions.SongplayPartitions`.
+songplay_partition_insert = ("""
+    INSERT INTO {partition} (
+        start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent,
+        source_file
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s
+    )
+""")
+
 songplay_table_insert = ("""
     INSERT INTO songplays (
         start_time,
@@ -132,6 +231,272 @@ time_table_insert = ("""
     ) ON CONFLICT DO NOTHING
 """)
 
+manifest_table_upsert = ("""
+    INSERT INTO load_manifest (
+        filepath,
+        size,
+        mtime,
+        content_hash
+    ) VALUES (
+        %s, %s, %s, %s
+    ) ON CONFLICT (filepath) DO UPDATE SET
+        size=EXCLUDED.size,
+        mtime=EXCLUDED.mtime,
+        content_hash=EXCLUDED.content_hash,
+        loaded_at=now()
+""")
+
+# STAGING TABLES
+
+# Session-local tables used by the COPY load mode. Each file's rows are
+# streamed into these with COPY FROM STDIN, then merged into the final
+# tables with one set-based INSERT per table (see MERGE FROM STAGING).
+
+time_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS time_staging (LIKE time)
+""")
+
+user_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS users_staging (LIKE users)
+""")
+
+song_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS songs_staging (LIKE songs)
+""")
+
+artist_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS artists_staging (LIKE artists)
+""")
+
+songplay_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS songplays_staging (
+        start_time TIMESTAMP NOT NULL,
+        user_id INT NOT NULL,
+        level TEXT,
+        song_id TEXT,
+        artist_id TEXT,
+        session_id INT,
+        location TEXT,
+        user_agent TEXT,
+        source_file TEXT
+    )
+""")
+
+staging_truncate = "TRUNCATE {table}"
+
+staging_copy = "COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{null}')"
+
+# MERGE FROM STAGING
+
+# These carry the same ON CONFLICT behaviour as the single-row inserts above.
+
+time_table_merge = ("""
+    INSERT INTO time (
+        start_time,
+        hour,
+        day,
+        week,
+        month,
+        year,
+        weekday
+    )
+    SELECT
+        start_time,
+        hour,
+        day,
+        week,
+        month,
+        year,
+        weekday
+    FROM time_staging
+    ORDER BY start_time
+    ON CONFLICT DO NOTHING
+""")
+
+# ON CONFLICT DO UPDATE may only touch each row once per statement, so
+# users_staging must hold at most one row per user_id. Rows are merged in
+# key order so that concurrent loaders lock them in the same order.
+user_table_merge = ("""
+    INSERT INTO users (
+        user_id,
+        first_name,
+        last_name,
+        gender,
+        level
+    )
+    SELECT
+        user_id,
+        first_name,
+        last_name,
+        gender,
+        level
+    FROM users_staging
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET level=EXCLUDED.level
+""")
+
+song_table_merge = ("""
+    INSERT INTO songs (
+        song_id,
+        title,
+        artist_id,
+        year,
+        duration
+    )
+    SELECT
+        song_id,
+        title,
+        artist_id,
+        year,
+        duration
+    FROM songs_staging
+    ORDER BY song_id
+    ON CONFLICT DO NOTHING
+""")
+
+artist_table_merge = ("""
+    INSERT INTO artists (
+        artist_id,
+        name,
+        location,
+        latitude,
+        longitude
+    )
+    SELECT
+        artist_id,
+        name,
+        location,
+        latitude,
+        longitude
+    FROM artists_staging
+    ORDER BY artist_id
+    ON CONFLICT DO NOTHING
+""")
+
+# {table} is the month partition the staged rows belong to.
+songplay_table_merge = ("""
+    INSERT INTO {table} (
+        start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent,
+        source_file
+    )
+    SELECT
+        start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent,
+        source_file
+    FROM songplays_staging
+""")
+
+# LOAD MANIFEST
+
+manifest_select = ("""
+    SELECT
+        filepath,
+        size,
+        mtime,
+        content_hash
+    FROM load_manifest
+""")
+
+# Refresh the stat of a file whose contents have not changed.
+manifest_stat_update = ("""
+    UPDATE load_manifest
+    SET size=%s, mtime=%s
+    WHERE filepath=%s
+""")
+
+manifest_entry_select = "SELECT 1 FROM load_manifest WHERE filepath=%s"
+
+# the song plays loaded from a log file, before the file is loaded again
+songplay_file_delete = "DELETE FROM songplays WHERE source_file=%s"
+
+# MIGRATIONS
+
+# songplays from before it was partitioned is an ordinary table ('r'),
+# rather than a partitioned one ('p')
+songplay_relkind_select = ("""
+    SELECT relkind
+    FROM pg_class
+    WHERE oid = to_regclass('songplays')
+""")
+
+songplay_legacy_rename = "ALTER TABLE songplays RENAME TO songplays_unpartitioned"
+
+# indexes (including the primary key's) keep their names when their table is
+# renamed, and would clash with those of the new table
+songplay_legacy_indexes_select = ("""
+    SELECT index_class.relname
+    FROM pg_index
+    JOIN pg_class index_class
+        ON pg_index.indexrelid = index_class.oid
+    WHERE pg_index.indrelid = to_regclass('songplays_unpartitioned')
+""")
+
+index_rename = "ALTER INDEX {index} RENAME TO {index}_unpartitioned"
+
+songplay_legacy_months_select = ("""
+    SELECT DISTINCT date_trunc('month', start_time)
+    FROM songplays_unpartitioned
+""")
+
+songplay_legacy_copy = ("""
+    INSERT INTO songplays (
+        songplay_id,
+        start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent
+    )
+    SELECT
+        songplay_id,
+        start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent
+    FROM songplays_unpartitioned
+""")
+
+# new ids continue after the copied ones
+songplay_id_sequence_reset = ("""
+    SELECT setval(
+        pg_get_serial_sequence('songplays', 'songplay_id'),
+        COALESCE(MAX(songplay_id), 0) + 1,
+        false
+    )
+    FROM songplays
+""")
+
+songplay_legacy_drop = "DROP TABLE songplays_unpartitioned"
+
+# TRANSACTION CONTROL
+
+# Each file is loaded inside its own savepoint, so that a bad file can be
+# rolled back without losing the rest of an uncommitted batch.
+
+file_savepoint = "SAVEPOINT load_file"
+file_savepoint_release = "RELEASE SAVEPOINT load_file"
+file_savepoint_rollback = "ROLLBACK TO SAVEPOINT load_file"
+
 # FIND SONGS
 
 song_select = ("""
@@ -146,14 +511,74 @@ song_select = ("""
         AND songs.duration = %s
 """)
 
+# Every (title, artist name, duration) key `song_select` can match, used
+# to build the in-memory `song_index.SongIndex`.
+song_lookup_select = ("""
+    SELECT
+        songs.title,
+        artists.name,
+        songs.duration,
+        songs.song_id,
+        songs.artist_id
+    FROM songs
+    JOIN artists
+        ON songs.artist_id = artists.artist_id
+    ORDER BY songs.song_id
+""")
+
+# ANALYTICS
+
+# Typical analyst queries, used by `benchmark.py --queries` to measure the
+# effect of the indexes above.
+
+plays_by_hour_select = ("""
+    SELECT 
+        date_trunc('hour', start_time) AS hour,
+        COUNT(*) AS plays
+    FROM songplays
+    WHERE start_time >= %(start)s
+        AND start_time < %(start)s + INTERVAL '1 day'
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+top_songs_select = ("""
+    SELECT 
+        songs.title,
+        artists.name,
+        COUNT(*) AS plays
+    FROM songplays
+    JOIN songs
+        ON songplays.song_id = songs.song_id
+    JOIN artists
+        ON songplays.artist_id = artists.artist_id
+    WHERE songplays.start_time >= %(start)s
+        AND songplays.start_time < %(start)s + INTERVAL '7 days'
+    GROUP BY 1, 2
+    ORDER BY 3 DESC
+    LIMIT 10
+""")
+
+songs_by_artist_select = ("""
+    SELECT 
+        songs.title,
+        songs.duration
+    FROM songs
+    JOIN artists
+        ON songs.artist_id = artists.artist_id
+    WHERE artists.name = %(artist_name)s
+""")
+
 # QUERY LISTS
 
 create_table_queries = [
     songplay_table_create, 
+    songplay_source_file_add,
     user_table_create,
     song_table_create,
     artist_table_create,
-    time_table_create
+    time_table_create,
+    manifest_table_create
 ]
 
 drop_table_queries = [
@@ -161,5 +586,18 @@ drop_table_queries = [
     user_table_drop, 
     song_table_drop,
     artist_table_drop,
-    time_table_drop
-]
\ No newline at end of file
+    time_table_drop,
+    manifest_table_drop
+]
+
+create_index_queries = [
+    song_lookup_index_create,
+    artist_lookup_index_create,
+    songplay_start_time_index_create
+]
+
+drop_index_queries = [
+    song_lookup_index_drop,
+    artist_lookup_index_drop,
+    songplay_start_time_index_drop
+]
@@ -0,0 +1,223 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+from cassandra.concurrent import execute_concurrent_with_args
+
+from fetch import page_frame
+
+# partition reads sent at once for the misses of one `get_many`
+CONCURRENCY = 50
+
+session_replay_select = ("""
+    SELECT item_in_session, artist_name, song_title, first_name, last_name
+    FROM sessions_by_user
+    WHERE user_id = ? AND session_id = ?
+""")
+
+play_select = ("""
+    SELECT artist_name, song_title, song_length
+    FROM plays
+    WHERE session_id = ? AND item_in_session = ?
+""")
+
+
+def result_frame(result):
+    """
+    All rows of a ResultSet as one DataFrame, reading any further pages.
+    """
+    pages = [page_frame(result.current_rows, result.column_names)]
+    while result.has_more_pages:
+        result.fetch_next_page()
+        pages.append(page_frame(result.current_rows, result.column_names))
+    return pd.concat(pages, ignore_index=True) if len(pages) > 1 else pages[0]
+
+
+class QueryCache:
+    """
+    Read-through cache of a keyed query: the result for a key is read from
+    Cassandra on a miss and served from memory until it is `ttl` seconds
+    old or is evicted as the least recently used of `maxsize` entries.
+
+    Concurrent misses on the same key are coalesced: only the first caller
+    queries Cassandra and the others wait for its result. The misses of one
+    `get_many` call are read together with concurrent requests. Failed
+    reads are not cached.
+
+    Cached DataFrames are shared between callers and must not be modified.
+
+    Parameters
+    ----------
+    session :
+        cassandra Session object, with its keyspace set
+    query :
+        CQL with one `?` marker per key column
+    ttl :
+        seconds a result is served before it is read again
+    maxsize :
+        maximum number of keys held
+    clock :
+        function returning the current time in seconds
+    """
+
+    def __init__(self, session, query, ttl=60, maxsize=10000, clock=time.monotonic):
+        self.session = session
+        self.statement = session.prepare(query)
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock()
+        # key -> (expiry time, DataFrame), least recently used first
+        self._entries = OrderedDict()
+        # key -> Future of a read in progress
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Hit and miss counters.
+
+        Returns
+        -------
+        dict of 'hits', 'misses', 'coalesced' (misses that waited for
+        another caller's read), 'evictions', 'expirations', 'size' and
+        'hit_rate'
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def get(self, key):
+        """
+        Query result for one key, e.g. (user_id, session_id).
+
+        Returns
+        -------
+        pandas DataFrame
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        Query results for many keys in one call. Keys that are not cached
+        and not already being read by another caller are read from
+        Cassandra together.
+
+        Parameters
+        ----------
+        keys :
+            iterable of key tuples
+
+        Returns
+        -------
+        list of pandas DataFrames, in the order of `keys`
+
+        Raises
+        ------
+        Exception
+            The read of one of the keys failed.
+        """
+        keys = [tuple(key) for key in keys]
+        results = {}
+        waiting = {}
+        to_read = []
+
+        with self._lock:
+            now = self.clock()
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[0] > now:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        results[key] = entry[1]
+                        continue
+                    del self._entries[key]
+                    self.expirations += 1
+
+                self.misses += 1
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    to_read.append(key)
+                else:
+                    self.coalesced += 1
+                waiting[key] = future
+
+        if to_read:
+            self._read(to_read)
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+        return [results[key] for key in keys]
+
+    def _read(self, keys):
+        """
+        Read `keys` from Cassandra, cache the results and resolve the
+        futures other callers wait on.
+        """
+        try:
+            outcomes = execute_concurrent_with_args(
+                self.session,
+                self.statement,
+                keys,
+                concurrency=CONCURRENCY,
+                raise_on_first_error=False
+            )
+            values = [
+                (key, success, result_frame(result) if success else result)
+                for key, (success, result) in zip(keys, outcomes)
+            ]
+        except Exception as e:
+            values = [(key, False, e) for key in keys]
+
+        with self._lock:
+            expires = self.clock() + self.ttl
+            for key, success, value in values:
+                future = self._inflight.pop(key)
+                if success:
+                    self._store(key, expires, value)
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _store(self, key, expires, value):
+        """Cache a result, evicting the least recently used entries."""
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+def session_replay_cache(session, ttl=60, maxsize=10000):
+    """
+    Cache of the songs of a user's session, keyed by (user_id, session_id).
+    """
+    return QueryCache(session, session_replay_select, ttl, maxsize)
+
+
+def play_cache(session, ttl=60, maxsize=10000):
+    """
+    Cache of single plays, keyed by (session_id, item_in_session).
+    """
+    return QueryCache(session, play_select, ttl, maxsize)
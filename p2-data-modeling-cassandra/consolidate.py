@@ -0,0 +1,141 @@
+import os
+import csv
+import glob
+import shutil
+import argparse
+import tempfile
+import multiprocessing as mp
+
+EVENT_DIR = 'event_data'
+EVENT_FILE = 'event_datafile_new.csv'
+
+HEADER = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+          'level', 'location', 'sessionId', 'song', 'userId']
+
+# positions in the raw event_data CSVs of the columns in `HEADER`
+COLUMNS = [0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16]
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_files(filepath=EVENT_DIR):
+    """
+    Paths to all CSV files in `filepath` and its subdirectories, sorted so
+    that the consolidated file has the same row order on every run.
+    """
+    return sorted(glob.glob(os.path.join(filepath, '**', '*.csv'), recursive=True))
+
+
+def copy_events(filepath, writer):
+    """
+    Stream the song plays of one raw event CSV into `writer`: rows without
+    an artist (events other than song plays) are dropped and the rest are
+    cut down to the columns in `COLUMNS`, one row at a time.
+
+    Parameters
+    ----------
+    filepath :
+        path to a raw event data CSV
+    writer :
+        csv writer for the consolidated file
+
+    Returns
+    -------
+    number of rows written
+    """
+    rows = 0
+    with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader)
+        for row in csvreader:
+            if row[0] == '':
+                continue
+            writer.writerow([row[i] for i in COLUMNS])
+            rows += 1
+    return rows
+
+
+def _copy_to_part(args):
+    """
+    Pool task: consolidate one input file into a part file of its own.
+    """
+    filepath, part_path = args
+    with open(part_path, 'w', encoding='utf8', newline='') as f:
+        return copy_events(filepath, csv.writer(f, dialect='myDialect'))
+
+
+def consolidate(files, output=EVENT_FILE, workers=1):
+    """
+    Write the song plays of all `files` into one CSV with the columns in
+    `HEADER`. Rows are streamed from each input straight to the output, so
+    memory use does not depend on how much event data there is.
+
+    With more than one worker, each input file is consolidated into a part
+    file of its own in parallel, and the parts are then appended to
+    `output` in input order, giving the same file as a serial run.
+
+    Parameters
+    ----------
+    files :
+        paths to raw event data CSVs
+    output :
+        path of the consolidated CSV
+    workers :
+        number of processes reading input files
+
+    Returns
+    -------
+    number of rows written, not counting the header
+    """
+    with open(output, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(HEADER)
+
+        if workers <= 1:
+            return sum(copy_events(filepath, writer) for filepath in files)
+
+        f.flush()
+        with tempfile.TemporaryDirectory() as tmp:
+            tasks = [
+                (filepath, os.path.join(tmp, '{}.csv'.format(i)))
+                for i, filepath in enumerate(files)
+            ]
+            with mp.Pool(workers) as pool:
+                rows = 0
+                # imap keeps input order, so parts are appended as they finish in order
+                for (_, part_path), part_rows in zip(tasks, pool.imap(_copy_to_part, tasks)):
+                    with open(part_path, encoding='utf8', newline='') as part:
+                        shutil.copyfileobj(part, f)
+                    os.remove(part_path)
+                    rows += part_rows
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Consolidate raw event data CSVs into event_datafile_new.csv"
+    )
+    parser.add_argument(
+        '-i', '--input',
+        dest="input_dir",
+        default=EVENT_DIR,
+        help="Directory of raw event data CSVs (default: {})".format(EVENT_DIR)
+    )
+    parser.add_argument(
+        '-o', '--output',
+        dest="output",
+        default=EVENT_FILE,
+        help="Consolidated CSV to write (default: {})".format(EVENT_FILE)
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        dest="workers",
+        default=1,
+        help="Number of processes reading input files (default: 1)"
+    )
+    args = parser.parse_args()
+
+    files = get_files(args.input_dir)
+    rows = consolidate(files, args.output, args.workers)
+    print('{} rows from {} files written to {}'.format(rows, len(files), args.output))
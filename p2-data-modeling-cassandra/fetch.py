@@ -0,0 +1,91 @@
+import pandas as pd
+from cassandra.query import SimpleStatement
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# rows per page; the whole result is never requested at once
+FETCH_SIZE = 5000
+
+
+def page_frame(rows, column_names):
+    """
+    A page of rows as a DataFrame. Rows may come from any row factory,
+    including one that already builds DataFrames.
+    """
+    if isinstance(rows, pd.DataFrame):
+        return rows
+    return pd.DataFrame(list(rows), columns=column_names)
+
+
+def fetch_pages(session, query, parameters=None, fetch_size=FETCH_SIZE, prefetch=True):
+    """
+    Run a query and yield its result one page at a time, so client memory
+    is bounded by `fetch_size` rows however large the partition read is.
+
+    With `prefetch`, the request for the next page is sent before the
+    current page is yielded, so the cluster works on it while the caller
+    processes the current one.
+
+    Parameters
+    ----------
+    session :
+        cassandra Session object
+    query :
+        CQL string, or a Statement (e.g. a bound prepared statement) whose
+        fetch size is replaced by `fetch_size`
+    parameters :
+        query parameters, if `query` is a string with placeholders
+    fetch_size :
+        maximum number of rows per page
+    prefetch :
+        request the next page before yielding the current one
+
+    Yields
+    ------
+    pandas DataFrame per page
+    """
+    if isinstance(query, str):
+        statement = SimpleStatement(query, fetch_size=fetch_size)
+    else:
+        statement = query
+        statement.fetch_size = fetch_size
+
+    future = session.execute_async(statement, parameters)
+    result = future.result()
+    while True:
+        rows = result.current_rows
+        has_more = future.has_more_pages
+        if has_more and prefetch:
+            future.start_fetching_next_page()
+
+        yield page_frame(rows, result.column_names)
+
+        if not has_more:
+            return
+        if not prefetch:
+            future.start_fetching_next_page()
+        result = future.result()
+
+
+def fetch_batches(session, query, parameters=None, fetch_size=FETCH_SIZE, prefetch=True):
+    """
+    Like `fetch_pages`, but yield each page as a pyarrow RecordBatch.
+    Requires pyarrow.
+    """
+    if pyarrow is None:
+        raise ImportError('fetch_batches requires pyarrow')
+
+    for df in fetch_pages(session, query, parameters, fetch_size, prefetch):
+        yield pyarrow.RecordBatch.from_pandas(df, preserve_index=False)
+
+
+def fetch_cql(session, query, parameters=None, fetch_size=FETCH_SIZE):
+    """
+    A query's whole result as one DataFrame, read page by page. For results
+    known to be small; iterate over `fetch_pages` otherwise.
+    """
+    pages = list(fetch_pages(session, query, parameters, fetch_size))
+    return pd.concat(pages, ignore_index=True) if len(pages) > 1 else pages[0]
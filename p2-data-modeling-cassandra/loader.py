@@ -0,0 +1,218 @@
+import csv
+import argparse
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+
+from tables import BUCKET_COLUMN, CSV_COLUMNS, QUERY_TABLES
+
+EVENT_FILE = 'event_datafile_new.csv'
+KEYSPACE = 'project2'
+
+# requests in flight at once; more only queue up on the cluster
+CONCURRENCY = 100
+
+keyspace_create = ("""
+    CREATE KEYSPACE IF NOT EXISTS {keyspace}
+    WITH REPLICATION =
+    {{ 'class' : 'SimpleStrategy', 'replication_factor' : 1 }}
+""")
+
+
+def create_tables(session, tables=QUERY_TABLES, reset=False):
+    """
+    Create each table in `tables` that does not exist yet, or with `reset`
+    drop and recreate every one.
+    """
+    for spec in tables:
+        if reset:
+            session.execute(spec.drop())
+        session.execute(spec.create())
+
+
+def prepare_inserts(session, tables=QUERY_TABLES):
+    """
+    Prepare one INSERT per table, once, on the cluster.
+
+    Parameters
+    ----------
+    session :
+        cassandra Session object
+    tables :
+        list of `tables.TableSpec`
+
+    Returns
+    -------
+    list of (prepared statement, `tables.TableSpec`) per table
+    """
+    return [(session.prepare(spec.insert()), spec) for spec in tables]
+
+
+def read_events(filepath=EVENT_FILE):
+    """
+    Stream the rows of an event data CSV, skipping the header.
+
+    Yields
+    ------
+    list of column values, positioned as in `tables.CSV_COLUMNS`
+    """
+    with open(filepath, encoding='utf8', newline='') as f:
+        csvreader = csv.reader(f)
+        next(csvreader)
+        yield from csvreader
+
+
+def column_layout(columns, bucket_by=None, buckets=1):
+    """
+    Position in the CSV and conversion (None to keep the text), for each of
+    `columns`. The bucket column of a bucketed table (see
+    `tables.TableSpec`) is `bucket_by` modulo `buckets`.
+    """
+    layout = []
+    for column in columns:
+        if column == BUCKET_COLUMN:
+            pos, _ = CSV_COLUMNS[bucket_by]
+            layout.append((pos, lambda value: int(value) % buckets))
+        else:
+            pos, cql_type = CSV_COLUMNS[column]
+            layout.append((pos, int if cql_type == 'INT' else None))
+    return layout
+
+
+def spec_layout(spec):
+    """`column_layout` of every column of a `tables.TableSpec`."""
+    return column_layout(spec.columns, spec.bucket_by, spec.buckets)
+
+
+def project(line, layout):
+    """
+    Pick the columns of a `column_layout` out of a CSV row.
+
+    Returns
+    -------
+    tuple of values in the order of the layout's columns
+    """
+    return tuple(convert(line[pos]) if convert else line[pos] for pos, convert in layout)
+
+
+def fan_out(prepared, lines):
+    """
+    One (statement, parameters) pair per table for every row in `lines`,
+    all from a single pass over `lines`.
+    """
+    layouts = [(statement, spec_layout(spec)) for statement, spec in prepared]
+    for line in lines:
+        for statement, layout in layouts:
+            yield statement, project(line, layout)
+
+
+def load_events(session, filepath=EVENT_FILE, tables=QUERY_TABLES, concurrency=CONCURRENCY):
+    """
+    Read an event data CSV once and insert every row into every table in
+    `tables`, however many there are. Inserts are sent asynchronously with at most `concurrency`
+    requests in flight, so throughput is set by the cluster rather than by
+    the round-trip time of each insert. Rows are read as requests complete;
+    the file is never held in memory.
+
+    Parameters
+    ----------
+    session :
+        cassandra Session object, with its keyspace set
+    filepath :
+        path to the event data CSV
+    tables :
+        list of `tables.TableSpec`
+    concurrency :
+        maximum number of inserts in flight
+
+    Returns
+    -------
+    (number of inserts written, list of errors of the inserts that failed)
+    """
+    prepared = prepare_inserts(session, tables)
+    results = execute_concurrent(
+        session,
+        fan_out(prepared, read_events(filepath)),
+        concurrency=concurrency,
+        raise_on_first_error=False,
+        results_generator=True
+    )
+
+    written = 0
+    errors = []
+    for success, result in results:
+        if success:
+            written += 1
+        else:
+            errors.append(result)
+    return written, errors
+
+
+def main(hosts, keyspace, filepath, concurrency, reset=False):
+    """
+    Create the keyspace and tables if needed (or recreate the tables with
+    `reset`), then load the event data CSV into every table.
+
+    Returns
+    -------
+    None
+    """
+    cluster = Cluster(hosts)
+    session = cluster.connect()
+
+    session.execute(keyspace_create.format(keyspace=keyspace))
+    session.set_keyspace(keyspace)
+    create_tables(session, reset=reset)
+
+    written, errors = load_events(session, filepath, concurrency=concurrency)
+    print('{} inserts written to {} tables'.format(written, len(QUERY_TABLES)))
+
+    session.shutdown()
+    cluster.shutdown()
+
+    if errors:
+        for error in errors[:10]:
+            print('Insert failed: {!r}'.format(error))
+        raise RuntimeError('{} inserts failed'.format(len(errors)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load event_datafile_new.csv into the Cassandra query tables"
+    )
+    parser.add_argument(
+        '-f', '--file',
+        dest="filepath",
+        default=EVENT_FILE,
+        help="Event data CSV to load (default: {})".format(EVENT_FILE)
+    )
+    parser.add_argument(
+        '--hosts',
+        nargs='+',
+        dest="hosts",
+        default=['127.0.0.1'],
+        help="Cassandra contact points"
+    )
+    parser.add_argument(
+        '-k', '--keyspace',
+        dest="keyspace",
+        default=KEYSPACE,
+        help="Keyspace to load into (default: {})".format(KEYSPACE)
+    )
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        dest="concurrency",
+        default=CONCURRENCY,
+        help="Maximum number of inserts in flight (default: {})".format(CONCURRENCY)
+    )
+    parser.add_argument(
+        '--reset',
+        action='store_true',
+        dest="reset",
+        default=False,
+        help="Drop and recreate the query tables before loading"
+    )
+    args = parser.parse_args()
+
+    main(args.hosts, args.keyspace, args.filepath, args.concurrency, args.reset)
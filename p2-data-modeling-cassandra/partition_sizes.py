@@ -0,0 +1,295 @@
+import time
+import random
+import argparse
+import statistics
+
+from cassandra.cluster import Cluster
+
+import loader
+from fetch import fetch_pages
+from tables import BUCKET_COLUMN, QUERY_TABLES, TableSpec
+
+# Alternative key designs to compare with `QUERY_TABLES`. Each still answers
+# its notebook query, with a coarser or finer partition.
+CANDIDATE_TABLES = [
+    # query 2 with one partition per user instead of per user session; the
+    # session is the first clustering column, so it can still be selected
+    TableSpec(
+        'sessions_by_user_coarse',
+        partition_key=['user_id'],
+        clustering_key=['session_id', 'item_in_session'],
+        columns=['artist_name', 'song_title', 'first_name', 'last_name'],
+        query_by=['user_id', 'session_id']
+    ),
+    # query 3 with each song's listeners spread over 4 partitions by user;
+    # the query reads all 4
+    TableSpec(
+        'songs_by_user_bucketed',
+        partition_key=['song_title'],
+        clustering_key=['user_id'],
+        columns=['first_name', 'last_name'],
+        bucket_by='user_id',
+        buckets=4
+    ),
+]
+
+class PartitionStats:
+    """
+    Rows and approximate bytes per partition of one table spec, as they
+    would be after loading the source CSV, and rows returned per value of
+    the table's query predicate. Rows with the same primary key overwrite
+    each other in Cassandra and are counted once.
+
+    Parameters
+    ----------
+    spec :
+        `tables.TableSpec`
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.predicate = spec.query_by
+        num_partition = len(spec.partition_key)
+        num_key = num_partition + len(spec.clustering_key)
+        self._partition = slice(0, num_partition)
+        self._clustering = slice(num_partition, num_key)
+        self._layout = loader.spec_layout(spec)
+        self._predicate_layout = loader.column_layout(self.predicate)
+        self.rows = {}
+        self.bytes = {}
+        self.query_rows = {}
+        self._keys = set()
+
+    def add(self, line):
+        """Count a CSV row against the partition it lands in."""
+        values = loader.project(line, self._layout)
+        partition = values[self._partition]
+        key = (partition, values[self._clustering])
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        self.rows[partition] = self.rows.get(partition, 0) + 1
+        query = loader.project(line, self._predicate_layout)
+        self.query_rows[query] = self.query_rows.get(query, 0) + 1
+        self.bytes[partition] = self.bytes.get(partition, 0) + sum(
+            len(str(value)) for value in values
+        )
+
+    def summary(self, top=5):
+        """
+        Partition count and size distribution.
+
+        Returns
+        -------
+        dict with 'table', 'partitions', 'rows', row count percentiles,
+        'max_bytes' and 'largest', a list of (partition key, rows, bytes)
+        for the `top` largest partitions
+        """
+        sizes = sorted(self.rows.values())
+
+        def percentile(p):
+            return sizes[min(len(sizes) - 1, int(p / 100 * len(sizes)))] if sizes else 0
+
+        largest = sorted(self.rows, key=self.rows.get, reverse=True)[:top]
+        return {
+            'table': self.spec.name,
+            'partition_key': self.spec.partition_key,
+            'partitions': len(sizes),
+            'rows': sum(sizes),
+            'mean_rows': statistics.mean(sizes) if sizes else 0,
+            'p50_rows': percentile(50),
+            'p95_rows': percentile(95),
+            'p99_rows': percentile(99),
+            'max_rows': sizes[-1] if sizes else 0,
+            'max_bytes': max(self.bytes.values(), default=0),
+            'largest': [(key, self.rows[key], self.bytes[key]) for key in largest],
+        }
+
+
+def analyze(specs, filepath=loader.EVENT_FILE):
+    """
+    Compute partition sizes for every spec in one pass over the CSV.
+
+    Returns
+    -------
+    list of `PartitionStats`, in the order of `specs`
+    """
+    stats = [PartitionStats(spec) for spec in specs]
+    for line in loader.read_events(filepath):
+        for table_stats in stats:
+            table_stats.add(line)
+    return stats
+
+
+def print_summaries(summaries):
+    """
+    Print a table of the partition size distribution per table, followed
+    by each table's largest partitions.
+    """
+    print('{:<26} {:>10} {:>8} {:>7} {:>7} {:>7} {:>7} {:>10}'.format(
+        'table', 'partitions', 'mean', 'p50', 'p95', 'p99', 'max', 'max bytes'
+    ))
+    for s in summaries:
+        print('{:<26} {:>10} {:>8.1f} {:>7} {:>7} {:>7} {:>7} {:>10}'.format(
+            s['table'], s['partitions'], s['mean_rows'], s['p50_rows'],
+            s['p95_rows'], s['p99_rows'], s['max_rows'], s['max_bytes']
+        ))
+    for s in summaries:
+        print('\nLargest partitions of {} ({}):'.format(s['table'], ', '.join(s['partition_key'])))
+        for key, rows, num_bytes in s['largest']:
+            print('  {!r}: {} rows, {} bytes'.format(key, rows, num_bytes))
+
+
+def query_statement(session, spec, predicate):
+    """
+    Prepared statement of a table's query: its predicate, plus the bucket
+    for bucketed tables.
+    """
+    where = predicate + ([BUCKET_COLUMN] if spec.bucket_by else [])
+    return session.prepare('SELECT * FROM {} WHERE {}'.format(
+        spec.name, ' AND '.join('{} = ?'.format(c) for c in where)
+    ))
+
+
+def run_query(session, statement, spec, key):
+    """
+    Read every row a table's query returns for one predicate value. The
+    buckets of a bucketed table are read concurrently.
+    """
+    if not spec.bucket_by:
+        for _ in fetch_pages(session, statement.bind(key)):
+            pass
+        return
+
+    futures = [
+        session.execute_async(statement.bind(key + (bucket,)))
+        for bucket in range(spec.buckets)
+    ]
+    for future in futures:
+        for _ in future.result():
+            pass
+
+
+def benchmark(session, stats, samples=100, repeat=3, seed=0):
+    """
+    Time each table's notebook query (see `TableSpec.query_by`): a point read
+    for 'plays', a whole partition or a slice of one for the others, and
+    every bucket for bucketed tables. Predicate values are the one that
+    returns the most rows plus a random sample, each queried `repeat`
+    times.
+
+    Parameters
+    ----------
+    session :
+        cassandra Session object, with the tables loaded
+    stats :
+        list of `PartitionStats` for the loaded tables
+    samples :
+        number of random predicate values queried per table
+    repeat :
+        queries per predicate value
+
+    Returns
+    -------
+    dict of table -> {'p50_ms', 'p95_ms', 'largest_ms'}
+    """
+    rng = random.Random(seed)
+    results = {}
+    for table_stats in stats:
+        spec = table_stats.spec
+        statement = query_statement(session, spec, table_stats.predicate)
+        keys = list(table_stats.query_rows)
+        largest = max(keys, key=table_stats.query_rows.get)
+        sample = rng.sample(keys, min(samples, len(keys)))
+
+        def read(key):
+            start = time.perf_counter()
+            run_query(session, statement, spec, key)
+            return (time.perf_counter() - start) * 1000
+
+        times = sorted(read(key) for key in sample for _ in range(repeat))
+        results[spec.name] = {
+            'p50_ms': times[len(times) // 2],
+            'p95_ms': times[min(len(times) - 1, int(0.95 * len(times)))],
+            'largest_ms': min(read(largest) for _ in range(repeat)),
+        }
+    return results
+
+
+def print_benchmark(results):
+    """
+    Print a table of query latencies per table.
+    """
+    print('{:<26} {:>9} {:>9} {:>12}'.format('table', 'p50 ms', 'p95 ms', 'largest ms'))
+    for table, r in results.items():
+        print('{:<26} {:>9.2f} {:>9.2f} {:>12.2f}'.format(
+            table, r['p50_ms'], r['p95_ms'], r['largest_ms']
+        ))
+
+
+def main(filepath, hosts=None, keyspace='project2_keys', samples=100):
+    """
+    Analyze partition sizes of the query tables and candidate key designs,
+    and with `hosts`, load them into a scratch keyspace and time their
+    queries.
+
+    Returns
+    -------
+    None
+    """
+    specs = QUERY_TABLES + CANDIDATE_TABLES
+    stats = analyze(specs, filepath)
+    print_summaries([table_stats.summary() for table_stats in stats])
+
+    if hosts:
+        cluster = Cluster(hosts)
+        session = cluster.connect()
+        session.execute(loader.keyspace_create.format(keyspace=keyspace))
+        session.set_keyspace(keyspace)
+        loader.create_tables(session, specs, reset=True)
+        written, errors = loader.load_events(session, filepath, specs)
+        if errors:
+            raise RuntimeError('{} inserts failed'.format(len(errors)))
+
+        print()
+        print_benchmark(benchmark(session, stats, samples))
+
+        session.shutdown()
+        cluster.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Partition size distribution and read benchmark of the "
+                    "p2 query tables and candidate key designs"
+    )
+    parser.add_argument(
+        '-f', '--file',
+        dest="filepath",
+        default=loader.EVENT_FILE,
+        help="Event data CSV (default: {})".format(loader.EVENT_FILE)
+    )
+    parser.add_argument(
+        '--hosts',
+        nargs='+',
+        dest="hosts",
+        default=None,
+        help="Cassandra contact points; if given, every design is loaded "
+             "into a scratch keyspace and its query is timed"
+    )
+    parser.add_argument(
+        '-k', '--keyspace',
+        dest="keyspace",
+        default='project2_keys',
+        help="Scratch keyspace for the benchmark; its tables are recreated on each run"
+    )
+    parser.add_argument(
+        '--samples',
+        type=int,
+        dest="samples",
+        default=100,
+        help="Random predicate values queried per table (default: 100)"
+    )
+    args = parser.parse_args()
+
+    main(args.filepath, args.hosts, args.keyspace, args.samples)
@@ -0,0 +1,132 @@
+# Position in event_datafile_new.csv and CQL type of every column, under the
+# names the query tables use for them
+CSV_COLUMNS = {
+    'artist_name': (0, 'TEXT'),
+    'first_name': (1, 'TEXT'),
+    'gender': (2, 'TEXT'),
+    'item_in_session': (3, 'INT'),
+    'last_name': (4, 'TEXT'),
+    'song_length': (5, 'TEXT'),
+    'subscription_level': (6, 'TEXT'),
+    'user_location': (7, 'TEXT'),
+    'session_id': (8, 'INT'),
+    'song_title': (9, 'TEXT'),
+    'user_id': (10, 'INT'),
+}
+
+
+# Column appended to the partition key of a bucketed table
+BUCKET_COLUMN = 'bucket'
+
+
+class TableSpec:
+    """
+    A query table, declared by its primary key and the other columns it
+    stores. Every column is a column of the source CSV (see
+    `CSV_COLUMNS`), so rows are written by projecting source rows;
+    `create` and `insert` generate the table's CQL.
+
+    A table may be bucketed: a `bucket` column, `bucket_by` modulo
+    `buckets`, is appended to the partition key, splitting each partition
+    into up to `buckets` smaller ones. Its query then reads every bucket.
+
+    Parameters
+    ----------
+    name :
+        table name
+    partition_key :
+        list of columns rows are partitioned by
+    clustering_key :
+        list of columns rows are ordered by within a partition
+    columns :
+        list of the other columns stored
+    bucket_by :
+        INT column the bucket is computed from, if the table is bucketed
+    buckets :
+        number of buckets
+    query_by :
+        list of the columns the table's query filters on; defaults to the
+        partition key (without the bucket)
+    """
+
+    def __init__(self, name, partition_key, clustering_key=(), columns=(),
+                 bucket_by=None, buckets=1, query_by=None):
+        self.name = name
+        self.query_by = list(query_by or partition_key)
+        self.bucket_by = bucket_by
+        self.buckets = buckets
+        self.partition_key = list(partition_key)
+        self.clustering_key = list(clustering_key)
+        source_columns = self.partition_key + self.clustering_key + list(columns)
+
+        unknown = set(
+            source_columns + self.query_by + ([bucket_by] if bucket_by else [])
+        ) - set(CSV_COLUMNS)
+        if unknown:
+            raise ValueError('{}: unknown columns {}'.format(name, sorted(unknown)))
+        if bucket_by is not None and CSV_COLUMNS[bucket_by][1] != 'INT':
+            raise ValueError('{}: bucket_by must be an INT column'.format(name))
+
+        if bucket_by is not None:
+            self.partition_key.append(BUCKET_COLUMN)
+            source_columns.insert(len(self.partition_key) - 1, BUCKET_COLUMN)
+        self.columns = source_columns
+
+    def column_type(self, column):
+        """CQL type of one of the table's columns."""
+        return 'INT' if column == BUCKET_COLUMN else CSV_COLUMNS[column][1]
+
+    def primary_key(self):
+        """PRIMARY KEY clause, e.g. '((user_id, session_id), item_in_session)'."""
+        partition = ', '.join(self.partition_key)
+        if len(self.partition_key) > 1:
+            partition = '({})'.format(partition)
+        return '({})'.format(', '.join([partition] + self.clustering_key))
+
+    def create(self):
+        """CREATE TABLE statement."""
+        columns = ''.join(
+            '    {} {},\n'.format(column, self.column_type(column))
+            for column in self.columns
+        )
+        return 'CREATE TABLE IF NOT EXISTS {} (\n{}    PRIMARY KEY {}\n)'.format(
+            self.name, columns, self.primary_key()
+        )
+
+    def drop(self):
+        """DROP TABLE statement."""
+        return 'DROP TABLE IF EXISTS {}'.format(self.name)
+
+    def insert(self):
+        """INSERT statement with a `?` marker per column, for preparing."""
+        return 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self.name, ', '.join(self.columns), ', '.join(['?'] * len(self.columns))
+        )
+
+
+# One entry per query. Adding a table here is all it takes to have it
+# created and filled on the next load, in the same pass over the CSV.
+QUERY_TABLES = [
+    # Query 1: artist, song title and length for a session and item in session
+    TableSpec(
+        'plays',
+        partition_key=['session_id'],
+        clustering_key=['item_in_session'],
+        columns=['artist_name', 'song_title', 'song_length'],
+        query_by=['session_id', 'item_in_session']
+    ),
+    # Query 2: artist, song and user name for a user's session, by item in session
+    TableSpec(
+        'sessions_by_user',
+        partition_key=['user_id', 'session_id'],
+        clustering_key=['item_in_session'],
+        columns=['artist_name', 'song_title', 'first_name', 'last_name']
+    ),
+    # Query 3: names of the users who listened to a song
+    TableSpec(
+        'songs_by_user',
+        partition_key=['song_title'],
+        clustering_key=['user_id'],
+        columns=['first_name', 'last_name']
+    ),
+]
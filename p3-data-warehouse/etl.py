@@ -2,34 +2,95 @@ import argparse
 import configparser
 
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
-
-
-def load_staging_tables(cur, conn):
-    """COPY data from S3 into staging tables. 
+from executor import print_timings, run_statements
+from sql_queries import (
+    copy_table_tasks,
+    insert_table_tasks,
+    merge_table_queries,
+    new_events_create,
+    new_events_max_ts,
+    staging_truncate_queries,
+    watermark_select,
+    watermark_table_create,
+    watermark_update,
+)
+
+
+def load_tables(connect, copy=True, insert=True, concurrency=1):
+    """COPY data from S3 into staging tables and/or insert relevant values 
+    from staging tables into star schema. 
+
+    Statements run concurrently on separate connections, each as soon as 
+    the statements it depends on are done (see `copy_table_tasks` and 
+    `insert_table_tasks`): dimension inserts start once their staging table 
+    is loaded, and songplays is inserted after all dimensions. 
+
+    COPY loads from the manifests written by prestage.py when LOG_MANIFEST 
+    or SONG_MANIFEST are set in dwh.cfg, otherwise from the raw S3 prefixes.
 
     Args:
-        cur (psycopg2 cursor): Cursor for DB connection
-        conn (psycopg2.connection): DB connection
+        connect (callable): Returns a new DB connection
+        copy (bool): Run COPY statements
+        insert (bool): Run INSERT statements
+        concurrency (int): Maximum number of statements running at once
+
+    Returns:
+        dict: Statement name -> (start, seconds)
     """
-    for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
+    tasks = {}
+    if copy:
+        tasks.update(copy_table_tasks)
+    if insert:
+        tasks.update(insert_table_tasks)
+
+    timings = run_statements(tasks, connect, concurrency)
+    print_timings(tasks, timings)
+    return timings
 
 
-def insert_tables(cur, conn):
-    """Insert relevant values from staging tables into star schema. 
+def merge_tables(cur, conn):
+    """Merge events newer than the high-watermark on staging_events.ts 
+    into star schema, upserting each table from a temp staging table. 
+
+    All merges and the watermark update are committed together, so a 
+    failed run leaves both the tables and the watermark as they were. 
+    Events arriving with a ts at or below the watermark are skipped. 
+    etl_watermarks is created if missing, so a warehouse built before it 
+    existed starts with no watermark and merges every staged event. 
 
     Args:
         cur (psycopg2 cursor): Cursor for DB connection
         conn (psycopg2.connection): DB connection
+
+    Returns:
+        datetime: New high-watermark, or None if there were no new events.
     """
-    for query in insert_table_queries:
+    cur.execute(watermark_table_create)
+    cur.execute(watermark_select)
+    row = cur.fetchone()
+    watermark = row[0] if row else None
+
+    cur.execute("DROP TABLE IF EXISTS new_events")
+    cur.execute(new_events_create, {'watermark': watermark})
+    cur.execute(new_events_max_ts)
+    high_watermark = cur.fetchone()[0]
+    if high_watermark is None:
+        print('No events newer than {}'.format(watermark))
+        conn.rollback()
+        return None
+
+    for query in merge_table_queries:
         cur.execute(query)
-        conn.commit()
+    for query in watermark_update:
+        cur.execute(query, {'high_watermark': high_watermark})
+    cur.execute("DROP TABLE new_events")
+    conn.commit()
 
+    print('Merged events from {} to {}'.format(watermark, high_watermark))
+    return high_watermark
 
-def main(insert_only, copy_only):
+
+def main(insert_only, copy_only, incremental=False, concurrency=1):
     """Run Sparkify ETL
 
     Args:
@@ -37,6 +98,12 @@ def main(insert_only, copy_only):
             data model. 
         copy_only (bool): Only run COPY statements to pull data from S3 into 
             staging tables. 
+        incremental (bool): Truncate staging tables before COPY, and merge 
+            only events newer than the last run instead of inserting 
+            everything in staging. 
+        concurrency (int): Maximum number of COPY and INSERT statements 
+            running at once. Incremental merges always run in order, in 
+            one transaction. 
 
     Raises:
         ValueError: Cannot pass both 'insert_only' and 'copy_only'. 
@@ -44,17 +111,25 @@ def main(insert_only, copy_only):
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    dsn = "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+    conn = psycopg2.connect(dsn)
     cur = conn.cursor()
     
     if insert_only and copy_only:
         raise ValueError('To run COPY and INSERTs, run without flags!')
     
-    if not insert_only:
-        load_staging_tables(cur, conn)
+    if not insert_only and incremental:
+        for query in staging_truncate_queries:
+            cur.execute(query)
+            conn.commit()
+
+    copy = not insert_only
+    insert = not copy_only and not incremental
+    if copy or insert:
+        load_tables(lambda: psycopg2.connect(dsn), copy, insert, concurrency)
 
-    if not copy_only:
-        insert_tables(cur, conn)
+    if not copy_only and incremental:
+        merge_tables(cur, conn)
 
     conn.close()
 
@@ -77,6 +152,21 @@ if __name__ == "__main__":
         default=False,
         help='Only run COPY statements to load data from S3'
     )
+    parser.add_argument(
+        '-n', '--incremental',
+        action='store_true',
+        dest="incremental",
+        default=False,
+        help='Only merge events newer than the last incremental run'
+    )
+    parser.add_argument(
+        '-j', '--concurrency',
+        type=int,
+        dest="concurrency",
+        default=1,
+        help='Maximum number of COPY and INSERT statements running at once, '
+             'each on its own connection (default: 1)'
+    )
     args = parser.parse_args()
     
-    main(args.insert_only, args.copy_only)
\ No newline at end of file
+    main(args.insert_only, args.copy_only, args.incremental, args.concurrency)
\ No newline at end of file
@@ -0,0 +1,149 @@
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def check_tasks(tasks):
+    """Check that the dependencies of `tasks` contain no cycle.
+
+    Dependencies on statements not in `tasks` are taken as already
+    satisfied, so a subset of a task graph can be run on its own.
+
+    Args:
+        tasks (dict): Statement name -> (query, list of names it depends on).
+
+    Raises:
+        ValueError: The dependencies contain a cycle.
+    """
+    done = set()
+    visiting = set()
+
+    def visit(name, path):
+        if name in done or name not in tasks:
+            return
+        if name in visiting:
+            raise ValueError('Dependency cycle: {}'.format(' -> '.join(path + [name])))
+        visiting.add(name)
+        for dep in tasks[name][1]:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for name in tasks:
+        visit(name, [])
+
+
+def critical_path(tasks, timings):
+    """Longest chain of dependent statements, by wall time.
+
+    Args:
+        tasks (dict): Statement name -> (query, list of names it depends on).
+        timings (dict): Statement name -> (start, seconds), as returned by
+            `run_statements`.
+
+    Returns:
+        tuple: (seconds, list of statement names along the path)
+    """
+    paths = {}
+
+    def longest(name):
+        if name not in paths:
+            deps = [longest(dep) for dep in tasks[name][1] if dep in timings]
+            seconds, path = max(deps, default=(0, []))
+            paths[name] = (seconds + timings[name][1], path + [name])
+        return paths[name]
+
+    return max((longest(name) for name in timings), default=(0, []))
+
+
+def run_statements(tasks, connect, concurrency=1):
+    """Run SQL statements concurrently, each as soon as its dependencies are done.
+
+    Every worker holds its own connection, and each statement is committed
+    on its own. After a failure no further statements are started; the
+    ones running are allowed to finish and the error is raised.
+
+    Args:
+        tasks (dict): Statement name -> (query, list of names it depends on).
+            Statements are started in dict order among those ready to run.
+        connect (callable): Returns a new psycopg2 connection.
+        concurrency (int): Maximum number of statements running at once.
+
+    Returns:
+        dict: Statement name -> (start, seconds), with start relative to
+            the start of the run.
+    """
+    check_tasks(tasks)
+    pending = dict(tasks)
+    finished = set()
+    timings = {}
+
+    connections = queue.Queue()
+    for _ in range(max(1, min(concurrency, len(tasks)))):
+        connections.put(connect())
+
+    run_start = time.perf_counter()
+
+    def execute(name, query):
+        conn = connections.get()
+        try:
+            start = time.perf_counter()
+            with conn.cursor() as cur:
+                cur.execute(query)
+            conn.commit()
+            timings[name] = (start - run_start, time.perf_counter() - start)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            connections.put(conn)
+
+    def ready():
+        return [
+            name for name, (_, deps) in pending.items()
+            if all(dep in finished or dep not in tasks for dep in deps)
+        ]
+
+    error = None
+    try:
+        with ThreadPoolExecutor(max(1, concurrency)) as executor:
+            running = {}
+            while pending or running:
+                if error is None:
+                    for name in ready():
+                        query, _ = pending.pop(name)
+                        running[executor.submit(execute, name, query)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        finished.add(name)
+    finally:
+        while not connections.empty():
+            connections.get().close()
+
+    if error is not None:
+        raise error
+    return timings
+
+
+def print_timings(tasks, timings):
+    """Print the wall time of each statement, the total and the critical path.
+
+    Args:
+        tasks (dict): Statement name -> (query, list of names it depends on).
+        timings (dict): Statement name -> (start, seconds).
+    """
+    print('{:<16} {:>9} {:>9}'.format('statement', 'start s', 'wall s'))
+    for name, (start, seconds) in sorted(timings.items(), key=lambda t: t[1][0]):
+        print('{:<16} {:>9.2f} {:>9.2f}'.format(name, start, seconds))
+
+    total = max((start + seconds for start, seconds in timings.values()), default=0)
+    path_seconds, path = critical_path(tasks, timings)
+    print('Total {:.2f}s, critical path {:.2f}s ({})'.format(
+        total, path_seconds, ' -> '.join(path)
+    ))
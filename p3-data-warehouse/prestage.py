@@ -0,0 +1,270 @@
+import os
+import gzip
+import heapq
+import json
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+
+class LocalStore:
+    """Files under a local directory, addressed by plain paths."""
+
+    def list(self, prefix, exclude=None):
+        """List (path, size) of every .json file under `prefix`.
+
+        Args:
+            prefix (str): Directory to list recursively.
+            exclude (str): Directory whose files are skipped, e.g. one
+                that packed objects are written to.
+
+        Returns:
+            list: (path, size in bytes) tuples, sorted by path.
+        """
+        exclude = os.path.join(exclude, '') if exclude else None
+        files = []
+        for root, _, names in os.walk(os.path.join(prefix, '')):
+            for name in names:
+                path = os.path.join(root, name)
+                if not name.endswith('.json') or (exclude and path.startswith(exclude)):
+                    continue
+                files.append((path, os.path.getsize(path)))
+        return sorted(files)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def upload(self, local_path, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        shutil.copyfile(local_path, path)
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+class S3Store:
+    """Objects in S3 (or an S3 stand-in such as moto), addressed by s3:// URLs.
+
+    Args:
+        client: boto3 S3 client. Defaults to one from the default session.
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            if boto3 is None:
+                raise ImportError('S3 access requires boto3')
+            client = boto3.client('s3')
+        self.client = client
+
+    @staticmethod
+    def split(url):
+        """Split 's3://bucket/key' into ('bucket', 'key')."""
+        bucket, _, key = url[len('s3://'):].partition('/')
+        return bucket, key
+
+    def list(self, prefix, exclude=None):
+        """List (url, size) of every .json object under `prefix`.
+
+        `prefix` is taken as a folder, so 's3://bucket/song_data' does not
+        pick up 's3://bucket/song_data_packed/...'.
+
+        Args:
+            prefix (str): s3:// URL of the folder to list.
+            exclude (str): s3:// URL of a folder whose objects are skipped,
+                e.g. one that packed objects are written to.
+
+        Returns:
+            list: (url, size in bytes) tuples, sorted by url.
+        """
+        bucket, key_prefix = self.split(prefix)
+        if key_prefix and not key_prefix.endswith('/'):
+            key_prefix += '/'
+        exclude = exclude.rstrip('/') + '/' if exclude else None
+        paginator = self.client.get_paginator('list_objects_v2')
+        files = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix):
+            for obj in page.get('Contents', []):
+                url = 's3://{}/{}'.format(bucket, obj['Key'])
+                if not url.endswith('.json') or (exclude and url.startswith(exclude)):
+                    continue
+                files.append((url, obj['Size']))
+        return sorted(files)
+
+    def read(self, url):
+        bucket, key = self.split(url)
+        return self.client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def upload(self, local_path, url):
+        bucket, key = self.split(url)
+        self.client.upload_file(local_path, bucket, key)
+
+    def write(self, url, data):
+        bucket, key = self.split(url)
+        self.client.put_object(Bucket=bucket, Key=key, Body=data)
+
+
+def get_store(url, client=None):
+    """Store for an s3:// URL or a local path."""
+    return S3Store(client) if url.startswith('s3://') else LocalStore()
+
+
+def pack(files, num_objects):
+    """Split files into `num_objects` groups of roughly equal total size.
+
+    Files are placed largest first, each into the group that is smallest so
+    far. Empty groups are dropped.
+
+    Args:
+        files (list): (path, size) tuples.
+        num_objects (int): Number of groups to pack into.
+
+    Returns:
+        list: Lists of paths, one per group, each in path order.
+    """
+    heap = [(0, i, []) for i in range(num_objects)]
+    for path, size in sorted(files, key=lambda f: f[1], reverse=True):
+        total, i, group = heapq.heappop(heap)
+        group.append(path)
+        heapq.heappush(heap, (total + size, i, group))
+    return [sorted(group) for _, _, group in sorted(heap, key=lambda g: g[1]) if group]
+
+
+def write_object(source, dest, paths, url):
+    """Concatenate source files into one gzipped object, one JSON document per line.
+
+    Args:
+        source (LocalStore or S3Store): Store the paths are read from.
+        dest (LocalStore or S3Store): Store the object is written to.
+        paths (list): Source files, read one at a time.
+        url (str): Path or URL of the object to write.
+
+    Returns:
+        int: Size of the compressed object in bytes.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.json.gz') as tmp:
+        with gzip.open(tmp.name, 'wb') as out:
+            for path in paths:
+                data = source.read(path).strip()
+                if data:
+                    out.write(data + b'\n')
+        size = os.path.getsize(tmp.name)
+        dest.upload(tmp.name, url)
+    return size
+
+
+def prestage(source_prefix, dest_prefix, slices, multiple=1, workers=8, client=None):
+    """Pack the small files under `source_prefix` into gzipped objects for COPY.
+
+    Redshift loads one file per slice at a time, so many tiny files leave
+    slices idle between files while few large ones leave slices with
+    nothing to do. The files are packed into `slices * multiple` objects of
+    roughly equal size, and a COPY manifest listing them is written to
+    `dest_prefix`/manifest.json.
+
+    Args:
+        source_prefix (str): s3:// URL or local directory of JSON files.
+        dest_prefix (str): s3:// URL or local directory to write objects
+            and manifest to.
+        slices (int): Number of slices in the cluster.
+        multiple (int): Objects per slice.
+        workers (int): Objects packed concurrently.
+        client: Optional boto3 S3 client, e.g. one for a moto mock.
+
+    Returns:
+        str: Path or URL of the manifest.
+    """
+    source = get_store(source_prefix, client)
+    dest = get_store(dest_prefix, client)
+    dest_prefix = dest_prefix.rstrip('/')
+
+    # packed objects and the manifest are never packed again, even when
+    # `dest_prefix` is under `source_prefix`
+    files = source.list(source_prefix, exclude=dest_prefix)
+    groups = pack(files, slices * multiple)
+    urls = [
+        '{}/part-{:05d}.json.gz'.format(dest_prefix, i)
+        for i in range(len(groups))
+    ]
+
+    with ThreadPoolExecutor(workers) as executor:
+        sizes = list(executor.map(
+            lambda args: write_object(source, dest, *args), zip(groups, urls)
+        ))
+
+    manifest = {
+        'entries': [
+            {'url': url, 'mandatory': True, 'meta': {'content_length': size}}
+            for url, size in zip(urls, sizes)
+        ]
+    }
+    manifest_url = dest_prefix + '/manifest.json'
+    dest.write(manifest_url, json.dumps(manifest, indent=2).encode())
+
+    print('{} files packed into {} objects, manifest written to {}'.format(
+        len(files), len(groups), manifest_url
+    ))
+    return manifest_url
+
+
+def cluster_slices():
+    """Number of slices in the cluster configured in dwh.cfg."""
+    import configparser
+    import psycopg2
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM stv_slices")
+    slices = cur.fetchone()[0]
+    conn.close()
+    return slices
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack small JSON files into gzipped objects sized for "
+                    "Redshift slices, and write a COPY manifest"
+    )
+    parser.add_argument('source', help='s3:// URL or local directory of JSON files')
+    parser.add_argument('dest', help='s3:// URL or local directory to write objects and manifest.json to')
+    parser.add_argument(
+        '-s', '--slices',
+        type=int,
+        dest="slices",
+        default=None,
+        help='Number of cluster slices. Read from the cluster in dwh.cfg if not given.'
+    )
+    parser.add_argument(
+        '-m', '--multiple',
+        type=int,
+        dest="multiple",
+        default=1,
+        help='Objects per slice (default: 1)'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        dest="workers",
+        default=8,
+        help='Objects packed concurrently (default: 8)'
+    )
+    args = parser.parse_args()
+
+    prestage(
+        args.source,
+        args.dest,
+        args.slices or cluster_slices(),
+        args.multiple,
+        args.workers
+    )
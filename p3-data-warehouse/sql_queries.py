@@ -10,6 +10,11 @@ LOG_JSON_SCHEMA_S3_URL = config.get('S3', 'LOG_JSONPATH')
 SONG_DATA_S3_URL = config.get('S3', 'SONG_DATA')
 REGION = config.get('S3', 'REGION')
 
+# Manifests written by prestage.py. When set, staging tables are loaded from
+# the packed, gzipped objects they list instead of the raw prefixes.
+LOG_MANIFEST_S3_URL = config.get('S3', 'LOG_MANIFEST', fallback=None)
+SONG_MANIFEST_S3_URL = config.get('S3', 'SONG_MANIFEST', fallback=None)
+
 IAM_ROLE = config.get('IAM_ROLE', 'ARN')
 
 # DROP TABLES
@@ -21,6 +26,7 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+watermark_table_drop = "DROP TABLE IF EXISTS etl_watermarks"
 
 # CREATE TABLES
 
@@ -145,6 +151,21 @@ time_table_create = """
     SORTKEY(start_time)
 """
 
+######################################################################
+# ETL State
+
+# High-watermarks of incremental loads: the latest staging timestamp
+# already merged into the warehouse tables, per source. Created IF NOT
+# EXISTS so an incremental run can add it to a warehouse built before it.
+######################################################################
+
+watermark_table_create = """
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        source TEXT PRIMARY KEY,
+        high_watermark TIMESTAMP
+    )
+"""
+
 # STAGING TABLES
 
 # See: https://docs.aws.amazon.com/redshift/latest/dg/copy-parameters-data-conversion.html#copy-timeformat
@@ -165,6 +186,30 @@ staging_songs_copy = f"""
     JSON 'auto'
 """
 
+# See: https://docs.aws.amazon.com/redshift/latest/dg/loading-data-files-using-manifest.html
+if LOG_MANIFEST_S3_URL:
+    staging_events_copy = f"""
+        COPY staging_events
+        FROM {LOG_MANIFEST_S3_URL}
+        REGION {REGION}
+        IAM_ROLE {IAM_ROLE}
+        JSON {LOG_JSON_SCHEMA_S3_URL}
+        TIMEFORMAT AS 'epochmillisecs'
+        GZIP
+        MANIFEST
+    """
+
+if SONG_MANIFEST_S3_URL:
+    staging_songs_copy = f"""
+        COPY staging_songs
+        FROM {SONG_MANIFEST_S3_URL}
+        REGION {REGION}
+        IAM_ROLE {IAM_ROLE}
+        JSON 'auto'
+        GZIP
+        MANIFEST
+    """
+
 # FINAL TABLES
 
 songplay_table_insert = """
@@ -193,6 +238,29 @@ songplay_table_insert = """
     WHERE se.page = 'NextSong'
 """
 
+# One row per user, from their latest event: a user whose level changed
+# gets their current level instead of one row per level.
+user_latest_select = """
+    SELECT
+        user_id,
+        first_name,
+        last_name,
+        gender,
+        level
+    FROM (
+        SELECT
+            userid AS user_id,
+            firstname AS first_name,
+            lastname AS last_name,
+            gender,
+            level,
+            ROW_NUMBER() OVER (PARTITION BY userid ORDER BY ts DESC) AS row_num
+        FROM {events}
+        WHERE page = 'NextSong'
+    ) AS ranked_users
+    WHERE row_num = 1
+"""
+
 user_table_insert = """
     INSERT INTO users (
         user_id,
@@ -201,15 +269,7 @@ user_table_insert = """
         gender,
         level
     )
-    SELECT DISTINCT
-        userid,
-        firstname,
-        lastname,
-        gender,
-        level
-    FROM staging_events
-    WHERE page = 'NextSong'
-"""
+""" + user_latest_select.format(events='staging_events')
 
 song_table_insert = """
     INSERT INTO songs (
@@ -228,6 +288,36 @@ song_table_insert = """
     FROM staging_songs
 """
 
+# One row per artist. staging_songs repeats the artist for each of their
+# songs, not always with the same details, so the row with the most of
+# location, latitude and longitude filled in is kept.
+artist_complete_select = """
+    SELECT
+        artist_id,
+        name,
+        location,
+        latitude,
+        longitude
+    FROM (
+        SELECT
+            artist_id,
+            artist_name AS name,
+            artist_location AS location,
+            artist_latitude AS latitude,
+            artist_longitude AS longitude,
+            ROW_NUMBER() OVER (
+                PARTITION BY artist_id
+                ORDER BY
+                    CASE WHEN artist_location <> '' THEN 1 ELSE 0 END
+                    + CASE WHEN artist_latitude IS NOT NULL THEN 1 ELSE 0 END
+                    + CASE WHEN artist_longitude IS NOT NULL THEN 1 ELSE 0 END DESC,
+                    song_id
+            ) AS row_num
+        FROM staging_songs
+    ) AS ranked_artists
+    WHERE row_num = 1
+"""
+
 artist_table_insert = """
     INSERT INTO artists (
         artist_id,
@@ -236,14 +326,7 @@ artist_table_insert = """
         latitude,
         longitude
     )
-    SELECT 
-        artist_id,
-        artist_name,
-        artist_location,
-        artist_latitude,
-        artist_longitude
-    FROM staging_songs
-"""
+""" + artist_complete_select
 
 time_table_insert = """
     INSERT INTO time (
@@ -267,6 +350,140 @@ time_table_insert = """
     WHERE page = 'NextSong'
 """
 
+# INCREMENTAL LOADS
+
+######################################################################
+# Incremental loads merge only the events newer than the watermark on
+# staging_events.ts. Each warehouse table is merged with a staging-table
+# upsert: the new rows are selected into a temp table, rows of the target
+# with the same key are deleted, and the temp table is inserted.
+# The COPY into staging is still a full reload of the configured S3
+# prefixes (or manifests); only the merge is incremental.
+# See: https://docs.aws.amazon.com/redshift/latest/dg/merge-replacing-existing-rows.html
+######################################################################
+
+staging_events_truncate = "TRUNCATE staging_events"
+staging_songs_truncate = "TRUNCATE staging_songs"
+
+watermark_select = """
+    SELECT high_watermark
+    FROM etl_watermarks
+    WHERE source = 'staging_events'
+"""
+
+watermark_update = [
+    "DELETE FROM etl_watermarks WHERE source = 'staging_events'",
+    "INSERT INTO etl_watermarks VALUES ('staging_events', %(high_watermark)s)",
+]
+
+new_events_create = """
+    CREATE TEMP TABLE new_events AS
+    SELECT *
+    FROM staging_events
+    WHERE %(watermark)s IS NULL OR ts > %(watermark)s
+"""
+
+new_events_max_ts = "SELECT MAX(ts) FROM new_events"
+
+time_stage_create = """
+    CREATE TEMP TABLE time_stage AS
+    SELECT DISTINCT
+        ts AS start_time,
+        EXTRACT(HOUR FROM ts) AS hour,
+        EXTRACT(DAY FROM ts) AS day,
+        EXTRACT(WEEK FROM ts) AS week,
+        EXTRACT(MONTH FROM ts) AS month,
+        EXTRACT(YEAR FROM ts) AS year,
+        EXTRACT(WEEKDAY FROM ts) AS weekday
+    FROM new_events
+    WHERE page = 'NextSong'
+"""
+
+user_stage_create = """
+    CREATE TEMP TABLE users_stage AS
+""" + user_latest_select.format(events='new_events')
+
+# staging_songs holds the whole song catalog on every run, so only artists
+# and songs that are missing from the target or differ from it are staged;
+# EXCEPT compares whole rows, with NULLs equal.
+artist_stage_create = """
+    CREATE TEMP TABLE artists_stage AS
+""" + artist_complete_select + """
+    EXCEPT
+    SELECT
+        artist_id,
+        name,
+        location,
+        latitude,
+        longitude
+    FROM artists
+"""
+
+song_stage_create = """
+    CREATE TEMP TABLE songs_stage AS
+    SELECT
+        song_id,
+        title,
+        artist_id,
+        year,
+        duration
+    FROM staging_songs
+    EXCEPT
+    SELECT
+        song_id,
+        title,
+        artist_id,
+        year,
+        duration
+    FROM songs
+"""
+
+# Songs are matched against the merged songs and artists tables rather
+# than staging_songs, so plays of songs loaded in earlier runs still match.
+songplay_stage_create = """
+    CREATE TEMP TABLE songplays_stage AS
+    SELECT
+        se.ts AS start_time,
+        se.userid AS user_id,
+        se.level,
+        s.song_id,
+        s.artist_id,
+        se.sessionid AS session_id,
+        se.location,
+        se.useragent AS user_agent
+    FROM new_events se
+    JOIN songs s
+        ON se.song = s.title
+    JOIN artists a
+        ON s.artist_id = a.artist_id AND se.artist = a.name
+    WHERE se.page = 'NextSong'
+"""
+
+
+def merge_queries(target, keys, columns, stage_create):
+    """Queries to upsert `target` from a temp staging table.
+
+    Args:
+        target (str): Warehouse table to merge into.
+        keys (list): Columns identifying a row of `target`.
+        columns (list): Columns of `target` filled from the stage.
+        stage_create (str): CREATE TEMP TABLE {target}_stage query.
+
+    Returns:
+        list: Queries to run in order, in one transaction.
+    """
+    stage = f'{target}_stage'
+    match = ' AND '.join(f'{target}.{key} = {stage}.{key}' for key in keys)
+    column_list = ', '.join(columns)
+    return [
+        f'DROP TABLE IF EXISTS {stage}',
+        stage_create,
+        f'DELETE FROM {target} USING {stage} WHERE {match}',
+        f'INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {stage}',
+        f'DROP TABLE {stage}',
+    ]
+
+
 # QUERY LISTS
 
 create_table_queries = [
@@ -277,6 +494,7 @@ create_table_queries = [
     artist_table_create, 
     song_table_create, 
     songplay_table_create, 
+    watermark_table_create,
 ]
 
 drop_table_queries = [
@@ -286,7 +504,8 @@ drop_table_queries = [
     user_table_drop, 
     song_table_drop, 
     artist_table_drop, 
-    time_table_drop
+    time_table_drop,
+    watermark_table_drop
 ]
 
 copy_table_queries = [
@@ -301,3 +520,72 @@ insert_table_queries = [
     artist_table_insert, 
     time_table_insert
 ]
+
+# STATEMENT DEPENDENCIES
+
+######################################################################
+# Statement name -> (query, names of the statements that must finish
+# first), for running independent statements concurrently. Dependencies
+# on statements that are not run (e.g. the COPYs with `etl.py -i`) are
+# taken as satisfied.
+######################################################################
+
+copy_table_tasks = {
+    'staging_events': (staging_events_copy, []),
+    'staging_songs': (staging_songs_copy, []),
+}
+
+# The dimensions only read staging tables, so they load independently.
+# songplays is kept after all of them so the fact table never references
+# a row its dimensions do not hold yet.
+insert_table_tasks = {
+    'time': (time_table_insert, ['staging_events']),
+    'users': (user_table_insert, ['staging_events']),
+    'songs': (song_table_insert, ['staging_songs']),
+    'artists': (artist_table_insert, ['staging_songs']),
+    'songplays': (
+        songplay_table_insert,
+        ['staging_events', 'staging_songs', 'time', 'users', 'songs', 'artists']
+    ),
+}
+
+staging_truncate_queries = [
+    staging_events_truncate,
+    staging_songs_truncate
+]
+
+# Dimensions are merged before songplays, which joins the merged songs
+# and artists.
+merge_table_queries = (
+    merge_queries(
+        'time',
+        ['start_time'],
+        ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday'],
+        time_stage_create
+    )
+    + merge_queries(
+        'users',
+        ['user_id'],
+        ['user_id', 'first_name', 'last_name', 'gender', 'level'],
+        user_stage_create
+    )
+    + merge_queries(
+        'artists',
+        ['artist_id'],
+        ['artist_id', 'name', 'location', 'latitude', 'longitude'],
+        artist_stage_create
+    )
+    + merge_queries(
+        'songs',
+        ['song_id'],
+        ['song_id', 'title', 'artist_id', 'year', 'duration'],
+        song_stage_create
+    )
+    + merge_queries(
+        'songplays',
+        ['start_time', 'user_id', 'session_id'],
+        ['start_time', 'user_id', 'level', 'song_id', 'artist_id',
+         'session_id', 'location', 'user_agent'],
+        songplay_stage_create
+    )
+)